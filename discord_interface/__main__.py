@@ -1,21 +1,31 @@
-import tomllib, os
+import tomllib, os, sys
 from typing import Any
 
-from disnake import Intents
-from disnake.ext.commands import Bot
+from startup import StartupProfiler
 
-from lib import get_prefix
+# python discord_interface --profile-startup prints how long every import and startup phase took before connecting to Discord.
+# Created before anything heavy is imported, so those imports are timed too.
+profiler = StartupProfiler("--profile-startup" in sys.argv[1:])
+
+with profiler.phase("imports"):
+    from disnake import Intents
+    from disnake.ext.commands import Bot
+
+    from lib import get_prefix
 
 def main() -> None:
 
-    with open("config.toml", "rb") as config_file:
-        config: dict[str, Any] = tomllib.load(config_file)
+    with profiler.phase("config"):
+        with open("config.toml", "rb") as config_file:
+            config: dict[str, Any] = tomllib.load(config_file)
 
     bot = Bot(
         command_prefix = get_prefix(config["default_prefix"]),
         case_insensitive = True,
         strip_after_prefix = True,
-        intents = Intents.all(), # Must change this when specifics about the bot are known.
+        # Students only talk to the bot in direct messages, but dev team commands are also sent in guild channels,
+        # so guild messages and their content are still needed. Member and presence events never are.
+        intents = Intents(guilds = True, guild_messages = True, dm_messages = True, message_content = True),
     )
 
     # Wonky workaround for loading the extensions while running the program from the outer project directory.
@@ -25,8 +35,10 @@ def main() -> None:
     for path, subdirs, files in os.walk(os.path.join(program_path, "extensions")):
         for name in files:
             if name.endswith(".py"):
-                bot.load_extension(f"extensions.{name[:-3]}", package = program_path)
+                with profiler.phase(f"extension {name[:-3]}"):
+                    bot.load_extension(f"extensions.{name[:-3]}", package = program_path)
 
+    profiler.report()
     print("Starting.")
     bot.run(config["api_key"])
 
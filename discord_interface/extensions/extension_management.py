@@ -1,145 +1,144 @@
-import os, sys
+import os, sys, asyncio, py_compile
+from dataclasses import dataclass
+from importlib.util import find_spec
+from time import perf_counter
+from typing import Callable, Literal, TypeAlias
 
-from disnake import Message, AppInfo
+from disnake import Message
 from disnake.ext.commands import Cog, Bot, Context, group, ExtensionNotFound, ExtensionNotLoaded, ExtensionAlreadyLoaded, NoEntryPointError, ExtensionFailed, check
 
+from lib import is_team_member
+
 __all__ = ()
 
+Action: TypeAlias = Literal["load", "reload", "unload"]
+
 def setup(bot: Bot) -> None:
     bot.add_cog(ExtensionManagement(bot))
 
+# The outcome of one extension operation, shown as one line in the summary.
+@dataclass(slots = True)
+class ExtensionOutcome:
+    name: str
+    status: str
+    seconds: float
+
 class ExtensionManagement(Cog):
+
+    extension_directory: str = os.path.dirname(os.path.abspath(__file__))
+
     def __init__(self, bot: Bot) -> None:
         self.bot: Bot = bot
 
+        # The directory is only listed again when its modification time changes.
+        self._extension_names: tuple[str, ...] = ()
+        self._extension_mtime: float | None = None
+
+    def extension_names(self) -> tuple[str, ...]:
+        mtime: float = os.stat(self.extension_directory).st_mtime
+        if mtime != self._extension_mtime:
+            with os.scandir(self.extension_directory) as entries:
+                self._extension_names = tuple(sorted(entry.name[:-3] for entry in entries if entry.is_file() and entry.name.endswith(".py")))
+            self._extension_mtime = mtime
+        return self._extension_names
+
     @staticmethod
-    async def is_team_member(ctx: Context) -> bool:
+    def prepare_extension(extension_name: str) -> None:
         """
-        Check if the user calling the command is a dev team member.
+        Find the extension's module and byte-compile it if the cached bytecode is stale.
+        Only touches the file system, so it is safe to run for many extensions at once in threads.
         """
 
-        app_info: AppInfo = await ctx.bot.application_info()
-        is_member: bool = ctx.author in app_info.team.members
-
-        if not is_member:
-            await ctx.reply("Only dev team members can use this command.")
-
-        return is_member
-
-    async def load_extension(self, extension_name: str, reply_message: Message) -> None:
-        message_content: str = reply_message.content
+        try:
+            spec = find_spec(f"extensions.{extension_name}")
+        except (ImportError, ValueError):
+            return
+
+        if spec is not None and spec.origin is not None and spec.origin.endswith(".py"):
+            try:
+                py_compile.compile(spec.origin, doraise = True)
+            except py_compile.PyCompileError:
+                # The real import reports the error with the rest of the outcomes.
+                pass
+
+    def apply_extension(self, action: Action, extension_name: str) -> ExtensionOutcome:
+        """
+        Load, reload or unload one extension. Changes the bot's state, so this must run on the event loop.
+        """
 
-        print(f"Loading extension: {extension_name}")
-        await reply_message.edit(f"{message_content}\nLoading: {extension_name}")
+        operation: Callable[[str], None] = {
+            "load": self.bot.load_extension,
+            "reload": self.bot.reload_extension,
+            "unload": self.bot.unload_extension,
+        }[action]
+        done: str = {"load": "Loaded", "reload": "Reloaded", "unload": "Unloaded"}[action]
 
+        start: float = perf_counter()
         try:
-            self.bot.load_extension(f"extensions.{extension_name}")
-            print(f"Loaded extension: {extension_name}")
-            await reply_message.edit(f"{message_content}\nLoaded: {extension_name}")
+            operation(f"extensions.{extension_name}")
+            print(f"{done} extension: {extension_name}")
+            status: str = done
         except ExtensionAlreadyLoaded:
-            print(f"Failed to load extension. Extension already loaded: {extension_name}")
-            await reply_message.edit(f"{message_content}\nAlready loaded: {extension_name}")
+            print(f"Failed to {action} extension. Extension already loaded: {extension_name}")
+            status = "Already loaded"
+        except ExtensionNotLoaded:
+            print(f"Failed to {action} extension. Extension not loaded: {extension_name}")
+            status = "Not loaded"
         except ExtensionNotFound:
-            print(f"Failed to load extension. Name not found: {extension_name}")
-            await reply_message.edit(f"{message_content}\nNo such extension: {extension_name}")
+            print(f"Failed to {action} extension. Name not found: {extension_name}")
+            status = "No such extension"
         except (NoEntryPointError, ExtensionFailed) as exception:
-            print(f"Failed to load extension. Code failed to execute: {extension_name}")
+            print(f"Failed to {action} extension. Code failed to execute: {extension_name}")
             print(exception, file = sys.stderr, flush = True)
-            await reply_message.edit(f"{message_content}\nCode error: {extension_name}")
+            status = "Code error"
+
+        return ExtensionOutcome(extension_name, status, perf_counter() - start)
+
+    async def bulk_extensions(self, ctx: Context, action: Action, extension_names: tuple[str, ...], title: str) -> None:
+        """
+        Run one action over many extensions and report every outcome in a single edit of one reply.
+        Modules are located and compiled concurrently first, then applied to the bot one by one.
+        """
+
+        reply_message: Message = await ctx.reply(f"**{title}:**")
+
+        start: float = perf_counter()
+        if action != "unload":
+            await asyncio.gather(*(asyncio.to_thread(self.prepare_extension, name) for name in extension_names))
+
+        outcomes: list[ExtensionOutcome] = [self.apply_extension(action, name) for name in extension_names]
+        total: float = perf_counter() - start
+
+        lines: list[str] = [f"**{title}:** done in {total * 1000:.0f} ms"]
+        lines.extend(f"{outcome.status}: {outcome.name} ({outcome.seconds * 1000:.0f} ms)" for outcome in outcomes)
+        await reply_message.edit("\n".join(lines)[:2000])
 
     @group(name = "load", invoke_without_command = True)
     @check(is_team_member)
     async def load(self, ctx: Context, *extension_names: str) -> None:
-        reply_message: Message = await ctx.reply(f"**Loading {len(extension_names)} extensions:**\n")
-
-        for name in extension_names:
-            reply_message = await self.load_extension(name, reply_message)
+        await self.bulk_extensions(ctx, "load", extension_names, f"Loading {len(extension_names)} extensions")
 
     @load.command(name = "all")
     @check(is_team_member)
     async def load_all(self, ctx: Context) -> None:
-        reply_message: Message = await ctx.reply(f"**Loading all extensions:**\n")
-
-        for _, _, files in os.walk(os.path.join(os.getcwd(), "extensions")):
-            for file in files:
-                if file.endswith(".py"):
-                    reply_message = await self.load_extension(file[:-3], reply_message)
-
-    async def reload_extension(self, extension_name: str, reply_message: Message) -> Message:
-        message_content: str = reply_message.content
-
-        print(f"Reloading extension: {extension_name}")
-        await reply_message.edit(f"{message_content}\nReloading: {extension_name}")
-
-        try:
-            self.bot.reload_extension(f"extensions.{extension_name}")
-            print(f"Reloaded extension: {extension_name}")
-            await reply_message.edit(f"{message_content}\nReloaded: {extension_name}")
-        except ExtensionNotLoaded:
-            print(f"Failed to reload extension. Extension not loaded: {extension_name}")
-            await reply_message.edit(f"{message_content}\nNot loaded: {extension_name}")
-        except ExtensionNotFound:
-            print(f"Failed to reload extension. Name not found: {extension_name}")
-            await reply_message.edit(f"{message_content}\nNo such extension: {extension_name}")
-        except (NoEntryPointError, ExtensionFailed) as exception:
-            print(f"Failed to reload extension. Code failed to execute: {extension_name}")
-            print(exception, file = sys.stderr, flush = True)
-            await reply_message.edit(f"{message_content}\nCode error: {extension_name}")
+        await self.bulk_extensions(ctx, "load", self.extension_names(), "Loading all extensions")
 
     @group(name = "reload", invoke_without_command = True)
     @check(is_team_member)
     async def reload(self, ctx: Context, *extension_names: str) -> None:
-        reply_message: Message = await ctx.reply(f"**Reloading {len(extension_names)} extensions:**\n")
-
-        for name in extension_names:
-            reply_message = await self.reload_extension(name, reply_message)
+        await self.bulk_extensions(ctx, "reload", extension_names, f"Reloading {len(extension_names)} extensions")
 
     @reload.command(name = "all")
     @check(is_team_member)
     async def reload_all(self, ctx: Context) -> None:
-        reply_message: Message = await ctx.reply(f"**Reloading all extensions:**\n")
-
-        for _, _, files in os.walk(os.path.join(os.getcwd(), "extensions")):
-            for file in files:
-                if file.endswith(".py"):
-                    reply_message = await self.reload_extension(file[:-3], reply_message)
-
-
-    async def unload_extension(self, extension_name: str, reply_message: Message) -> Message:
-        message_content: str = reply_message.content
-
-        print(f"Unloading extension: {extension_name}")
-        await reply_message.edit(f"{message_content}\nUnloading: {extension_name}")
-
-        try:
-            self.bot.unload_extension(f"extensions.{extension_name}")
-            print(f"Unloaded extension: {extension_name}")
-            await reply_message.edit(f"{message_content}\nUnloaded: {extension_name}")
-        except ExtensionNotLoaded:
-            print(f"Failed to unload extension. Extension not loaded: {extension_name}")
-            await reply_message.edit(f"{message_content}\nNot loaded: {extension_name}")
-        except ExtensionNotFound:
-            print(f"Failed to unload extension. Name not found: {extension_name}")
-            await reply_message.edit(f"{message_content}\nNo such extension: {extension_name}")
-        except (NoEntryPointError, ExtensionFailed) as exception:
-            print(f"Failed to unload extension. Code failed to execute: {extension_name}")
-            print(exception, file = sys.stderr, flush = True)
-            await reply_message.edit(f"{message_content}\nCode error: {extension_name}")
+        await self.bulk_extensions(ctx, "reload", self.extension_names(), "Reloading all extensions")
 
     @group(name = "unload", invoke_without_command = True)
     @check(is_team_member)
     async def unload(self, ctx: Context, *extension_names: str) -> None:
-        reply_message: Message = await ctx.reply(f"**Unloading {len(extension_names)} extensions:**\n")
-
-        for name in extension_names:
-            reply_message = await self.unload_extension(name, reply_message)
+        await self.bulk_extensions(ctx, "unload", extension_names, f"Unloading {len(extension_names)} extensions")
 
     @unload.command(name = "all")
     @check(is_team_member)
     async def unload_all(self, ctx: Context) -> None:
-        reply_message: Message = await ctx.reply(f"**Unloading all extensions:**\n")
-
-        for _, _, files in os.walk(os.path.join(os.getcwd(), "extensions")):
-            for file in files:
-                if file.endswith(".py"):
-                    reply_message = await self.unload_extension(file[:-3], reply_message)
\ No newline at end of file
+        await self.bulk_extensions(ctx, "unload", self.extension_names(), "Unloading all extensions")
@@ -1,9 +1,12 @@
 import tomllib, json, websockets
+from time import perf_counter
 from typing import Any
 from traceback import format_exc
 
-from disnake import Message, Event
-from disnake.ext.commands import Cog, Bot, Context
+from disnake import Message, Event, User
+from disnake.ext.commands import Cog, Bot, Context, command, group, check
+
+from lib import is_team_member, RequestTrace, TraceStore, MessageFilter, from_human, in_direct_message, passes_filters
 
 __all__ = ()
 
@@ -20,10 +23,21 @@ class Listener(Cog):
         self.server_ip: str = config["server_ip"]
         self.port: int = config["port"]
         self.bytes_limit: int = config["bytes_limit"]
+        # Seconds a prompt may wait in the server's queue before the server gives up on it.
+        self.request_timeout: float | None = config.get("request_timeout")
+        # Secret the LLM server expects with admin messages.
+        self.admin_token: str | None = config.get("admin_token")
 
         self.socket: websockets.WebSocketClientProtocol | None = None
 
-        self.waiting_list: dict[int, tuple[Message, Message]] = {}
+        self.waiting_list: dict[int, tuple[Message, Message, RequestTrace]] = {}
+
+        # Checked before the command context is parsed. Guild traffic is by far the most common, so it goes first.
+        self.message_filters: tuple[MessageFilter, ...] = (in_direct_message, from_human)
+        self.traces: TraceStore = TraceStore()
+
+        # Where to report the answers to the last admin command sent to the server.
+        self.admin_context: Context | None = None
 
     @Cog.listener(Event.ready)
     async def connect(self) -> None:
@@ -50,9 +64,12 @@ class Listener(Cog):
         Listens to messages in private messages to respond to.
         """
 
+        origin: float = perf_counter()
+
         # Filter messages to only relevant ones.
+        if not passes_filters(message, self.message_filters): return
         context: Context = await self.bot.get_context(message)
-        if message.author.bot or message.guild or context.command: return
+        if context.command: return
 
         if message.author.id in self.waiting_list.keys():
             await message.reply("Please wait until reply has finished generating before sending more messages.")
@@ -60,45 +77,198 @@ class Listener(Cog):
 
         print("Received a prompt.")
 
-        self.waiting_list[message.author.id] = (message, await message.reply("Please wait while reply is being generated.", mention_author = False))
+        trace = RequestTrace(message.author.id, origin)
+        trace.record("filter", trace.origin, perf_counter())
+
+        with trace.span("placeholder"):
+            temporary: Message = await message.reply("Please wait while reply is being generated.", mention_author = False)
+        self.waiting_list[message.author.id] = (message, temporary, trace)
 
         try:
             print("Sending prompt to LLM server.")
-            await self.socket.send(json.dumps({"id": message.author.id, "text": message.content}))
+            trace.sent = perf_counter()
+            package: dict[str, Any] = {"id": message.author.id, "request_id": trace.request_id, "text": message.content}
+            if self.request_timeout is not None:
+                package["timeout"] = self.request_timeout
+            await self.socket.send(json.dumps(package))
 
         except Exception as e:
-            _, temporary = self.waiting_list.pop(message.author.id)
+            _, temporary, _ = self.waiting_list.pop(message.author.id)
             await temporary.delete()
             await message.reply("Something went wrong.", mention_author = False)
             print("Error encountered.")
             print(format_exc())
 
+    @Cog.listener(Event.message_delete)
+    async def cancel(self, message: Message) -> None:
+        """
+        Cancels the pending prompt if the user deletes it, so the server doesn't generate a reply nobody wants.
+        """
+
+        if message.author.id not in self.waiting_list.keys() or self.waiting_list[message.author.id][0].id != message.id:
+            return
+
+        print("Prompt deleted. Cancelling.")
+
+        _, temporary, trace = self.waiting_list.pop(message.author.id)
+        await temporary.delete()
+
+        try:
+            await self.socket.send(json.dumps({"type": "cancel", "request_id": trace.request_id}))
+        except Exception:
+            print("Error encountered.")
+            print(format_exc())
+
+    def pending(self, package: dict[str, Any]) -> tuple[Message, Message, RequestTrace] | None:
+        """
+        Find the waiting prompt a message from the server is about.
+        Messages about a prompt that has since been cancelled are ignored.
+        """
+
+        waiting: tuple[Message, Message, RequestTrace] | None = self.waiting_list.get(package["id"])
+        if waiting is None or waiting[2].request_id != package.get("request_id", waiting[2].request_id):
+            return None
+        return waiting
+
     async def send(self) -> None:
 
         print("Waiting for responses.")
 
         async for message in self.socket:
             package: dict[str, Any] = json.loads(message)
+
+            if package.get("type") in ("status", "model_loaded", "model_load_failed"):
+                await self.report_admin(package)
+                continue
+
+            waiting: tuple[Message, Message, RequestTrace] | None = self.pending(package)
+            if waiting is None:
+                continue
+
+            original, temporary, trace = waiting
+
+            match package.get("type", "reply"):
+                case "queued" if not package.get("ready", True):
+                    await temporary.edit("Please wait while reply is being generated. The assistant is starting up, this can take a few minutes.")
+                    continue
+                case "queued":
+                    await temporary.edit(f"Please wait while reply is being generated. You are number {package['position']} in the queue.")
+                    continue
+                case "started":
+                    await temporary.edit("Please wait while reply is being generated. Your reply is being written now.")
+                    continue
+                case "expired":
+                    print("Prompt expired in the queue.")
+                    del self.waiting_list[package["id"]]
+                    await temporary.delete()
+                    await original.reply("Sorry, too many students are asking questions right now. Please try again in a little while.", mention_author = False)
+                    continue
+                case "rate_limited":
+                    print("Prompt refused by the rate limit.")
+                    del self.waiting_list[package["id"]]
+                    await temporary.delete()
+                    await original.reply(f"You have asked a lot of questions in a short time. Please try again in {max(round(package['retry_after']), 1)} seconds.", mention_author = False)
+                    continue
+
             print("Received response.")
 
-            original, temporary = self.waiting_list.pop(package["id"])
+            del self.waiting_list[package["id"]]
+            trace.received(package.get("spans", []))
 
-            await temporary.delete()
-            
-            if len(package["text"].strip()) == 0:
-                print("Empty response received.") 
-                await original.channel.send("I'm sorry, I could not find a response to that.")
-            
-            elif len(package["text"]) <= 2000:
-                print("Short response received.")
-                await original.channel.send(package["text"])
-            
-            else:
-                print("Long response received.")
-                n_messages: int = len(package["text"]) // 2000 + 1
-                n_character_per: int = len(package["text"]) // n_messages
-
-                for i in range(n_messages):
-                    msg = package["text"][i * n_character_per:i * n_character_per + n_character_per]
-                    if len(msg) != 0:
-                        await original.channel.send(msg)
+            with trace.span("discord_send"):
+                await temporary.delete()
+
+                if len(package["text"].strip()) == 0:
+                    print("Empty response received.")
+                    await original.channel.send("I'm sorry, I could not find a response to that.")
+
+                elif len(package["text"]) <= 2000:
+                    print("Short response received.")
+                    await original.channel.send(package["text"])
+
+                else:
+                    print("Long response received.")
+                    n_messages: int = len(package["text"]) // 2000 + 1
+                    n_character_per: int = len(package["text"]) // n_messages
+
+                    for i in range(n_messages):
+                        msg = package["text"][i * n_character_per:i * n_character_per + n_character_per]
+                        if len(msg) != 0:
+                            await original.channel.send(msg)
+
+            trace.finish()
+            self.traces.add(trace)
+
+    async def report_admin(self, package: dict[str, Any]) -> None:
+        if self.admin_context is None:
+            return
+
+        match package["type"]:
+            case "status":
+                lines: list[str] = [
+                    f"Ready: {package['ready']}",
+                    f"Model: {package['model_path']}",
+                    f"Loading: {package['loading']}",
+                    f"Queued prompts: {package['queue_depth']}",
+                ]
+                await self.admin_context.reply("\n".join(lines))
+            case "model_loaded":
+                await self.admin_context.reply(f"Switched to {package['model_path']} after {package['seconds']:.1f}s. Old requests finish on the previous model.")
+            case "model_load_failed":
+                await self.admin_context.reply(f"Failed to load {package['model_path']}: {package['error']}")
+
+    async def send_admin(self, ctx: Context, package: dict[str, Any]) -> None:
+        self.admin_context = ctx
+        try:
+            await self.socket.send(json.dumps(package))
+        except Exception:
+            await ctx.reply("Could not reach the LLM server.")
+            print(format_exc())
+
+    @group(name = "model", invoke_without_command = True)
+    @check(is_team_member)
+    async def model(self, ctx: Context) -> None:
+        """
+        Show which model the LLM server is running and whether it is ready.
+        """
+
+        await self.send_admin(ctx, {"type": "status"})
+
+    @model.command(name = "load")
+    @check(is_team_member)
+    async def model_load(self, ctx: Context, model_path: str) -> None:
+        """
+        Load another model on the LLM server in the background and switch to it when it is ready.
+        """
+
+        await self.send_admin(ctx, {"type": "load_model", "model_path": model_path, "admin_token": self.admin_token})
+
+    @command(name = "latency")
+    @check(is_team_member)
+    async def latency(self, ctx: Context, user: User | None = None, count: int = 5) -> None:
+        """
+        Show where the time went for a user's last requests, and a rolling summary across all users.
+        """
+
+        user = ctx.author if user is None else user
+        lines: list[str] = [f"**Last {count} requests from {user.display_name}:**", "```"]
+
+        traces: list[RequestTrace] = self.traces.last(user.id, count)
+        if len(traces) == 0:
+            lines.append("No finished requests recorded.")
+
+        for trace in traces:
+            breakdown: dict[str, float] = trace.breakdown()
+            total: float = breakdown.pop("total")
+            lines.append(f"{trace.request_id[:8]} total {total:7.2f}s")
+            lines.extend(f"    {stage:<20} {seconds:7.2f}s" for stage, seconds in breakdown.items())
+
+        lines.extend(("```", f"**Rolling summary over {len(self.traces)} requests:**", "```", f"{'stage':<20} {'mean':>8} {'p50':>8} {'p95':>8}"))
+        for stage, (mean, median, p95) in self.traces.summary().items():
+            lines.append(f"{stage:<20} {mean:7.2f}s {median:7.2f}s {p95:7.2f}s")
+        lines.append("```")
+
+        text: str = "\n".join(lines)
+        if len(text) > 2000:
+            text = f"{text[:1993]}\n...```"
+        await ctx.reply(text)
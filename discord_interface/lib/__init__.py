@@ -1 +1,4 @@
 from .prefix import *
+from .checks import *
+from .filters import *
+from .tracing import *
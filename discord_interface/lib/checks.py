@@ -0,0 +1,38 @@
+from time import monotonic
+
+from disnake import AppInfo
+from disnake.ext.commands import Bot, Context
+
+__all__ = "is_team_member", "get_application_info"
+
+# Seconds the application info is reused before it is fetched from Discord again.
+APP_INFO_TTL: float = 300.0
+
+_app_info_cache: dict[int, tuple[float, AppInfo]] = {}
+
+async def get_application_info(bot: Bot, ttl: float = APP_INFO_TTL) -> AppInfo:
+    """
+    The bot's application info, cached for ttl seconds because team membership rarely changes
+    and fetching it is a round trip to Discord.
+    """
+
+    cached: tuple[float, AppInfo] | None = _app_info_cache.get(id(bot))
+    if cached is not None and monotonic() - cached[0] < ttl:
+        return cached[1]
+
+    app_info: AppInfo = await bot.application_info()
+    _app_info_cache[id(bot)] = (monotonic(), app_info)
+    return app_info
+
+async def is_team_member(ctx: Context) -> bool:
+    """
+    Check if the user calling the command is a dev team member.
+    """
+
+    app_info: AppInfo = await get_application_info(ctx.bot)
+    is_member: bool = ctx.author in app_info.team.members
+
+    if not is_member:
+        await ctx.reply("Only dev team members can use this command.")
+
+    return is_member
@@ -0,0 +1,22 @@
+from typing import Callable, Iterable, TypeAlias
+
+from disnake import Message
+
+__all__ = "MessageFilter", "from_human", "in_direct_message", "passes_filters"
+
+# A cheap check on a raw message. Returning False drops the message before any parsing is done.
+MessageFilter: TypeAlias = Callable[[Message], bool]
+
+def from_human(message: Message) -> bool:
+    return not message.author.bot
+
+def in_direct_message(message: Message) -> bool:
+    return message.guild is None
+
+def passes_filters(message: Message, filters: Iterable[MessageFilter]) -> bool:
+    """
+    Run the filters in order and stop at the first that rejects the message.
+    Put the filters that reject the most traffic first.
+    """
+
+    return all(message_filter(message) for message_filter in filters)
@@ -0,0 +1,119 @@
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Any, Iterator
+from uuid import uuid4
+
+__all__ = "RequestTrace", "TraceStore"
+
+class RequestTrace:
+    """
+    Timings for one prompt, from the Discord message arriving to the last reply message being sent.
+    Holds the bot's own spans and the spans the LLM server reports back with its reply.
+    """
+
+    __slots__ = "request_id", "user_id", "created", "origin", "spans", "server_spans", "sent", "finished"
+
+    def __init__(self, user_id: int, origin: float | None = None) -> None:
+        self.request_id: str = uuid4().hex
+        self.user_id: int = user_id
+        self.created: float = time()
+        self.origin: float = perf_counter() if origin is None else origin
+        self.spans: list[tuple[str, float, float]] = []
+        self.server_spans: list[dict[str, Any]] = []
+        self.sent: float | None = None
+        self.finished: float | None = None
+
+    def record(self, name: str, start: float, end: float) -> None:
+        self.spans.append((name, start, end))
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start: float = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, perf_counter())
+
+    def received(self, server_spans: list[dict[str, Any]]) -> None:
+        """
+        Call when the server's reply arrives. Everything between sending the prompt and now is the round trip.
+        """
+
+        self.server_spans = server_spans
+        if self.sent is not None:
+            self.record("round_trip", self.sent, perf_counter())
+
+    def finish(self) -> None:
+        self.finished = perf_counter()
+
+    @property
+    def total(self) -> float:
+        return (perf_counter() if self.finished is None else self.finished) - self.origin
+
+    def breakdown(self) -> dict[str, float]:
+        """
+        Seconds spent in each stage.
+        The server's spans are prefixed with `server.` and whatever the server can't account for
+        between sending the prompt and receiving the reply is attributed to the network.
+        """
+
+        result: dict[str, float] = {}
+        for name, start, end in self.spans:
+            if name != "round_trip":
+                result[name] = result.get(name, 0.0) + end - start
+                continue
+
+            server_total: float = 0.0
+            for span in self.server_spans:
+                result[f"server.{span['name']}"] = result.get(f"server.{span['name']}", 0.0) + span["duration"]
+                server_total += span["duration"]
+            result["network"] = max(0.0, end - start - server_total)
+
+        result["total"] = self.total
+        return result
+
+class TraceStore:
+    """
+    Keeps the most recent finished traces per user and a rolling window across all users.
+    """
+
+    __slots__ = "per_user", "_by_user", "_recent"
+
+    def __init__(self, per_user: int = 20, window: int = 200) -> None:
+        self.per_user: int = per_user
+        self._by_user: dict[int, deque[RequestTrace]] = {}
+        self._recent: deque[RequestTrace] = deque(maxlen = window)
+
+    def add(self, trace: RequestTrace) -> None:
+        if trace.user_id not in self._by_user:
+            self._by_user[trace.user_id] = deque(maxlen = self.per_user)
+        self._by_user[trace.user_id].append(trace)
+        self._recent.append(trace)
+
+    def last(self, user_id: int, count: int) -> list[RequestTrace]:
+        traces: deque[RequestTrace] = self._by_user.get(user_id, deque())
+        return list(traces)[-count:]
+
+    def summary(self) -> dict[str, tuple[float, float, float]]:
+        """
+        Mean, median and 95th percentile in seconds per stage over the rolling window.
+        """
+
+        stages: dict[str, list[float]] = {}
+        for trace in self._recent:
+            for stage, seconds in trace.breakdown().items():
+                stages.setdefault(stage, []).append(seconds)
+
+        result: dict[str, tuple[float, float, float]] = {}
+        for stage, values in stages.items():
+            values.sort()
+            result[stage] = (
+                sum(values) / len(values),
+                values[len(values) // 2],
+                values[min(len(values) - 1, int(len(values) * 0.95))]
+            )
+        return result
+
+    def __len__(self) -> int:
+        return len(self._recent)
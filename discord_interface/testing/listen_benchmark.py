@@ -0,0 +1,97 @@
+"""
+Measures how many message events per second Listener.listen gets through, without connecting to Discord.
+
+A fake gateway feeds the listener a mix of guild, bot and direct messages like the ones the bot sees in practice.
+Run it from the StudassBot directory so the listener finds config.toml:
+    python discord_interface/testing/listen_benchmark.py
+"""
+
+import asyncio, os, random, sys
+from time import perf_counter
+from types import SimpleNamespace
+
+# Same workaround as in __main__.py so the extensions can import lib.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extensions.listener import Listener
+
+class FakeMessage:
+    """
+    Only has the attributes Listener.listen touches.
+    """
+
+    __slots__ = "id", "author", "guild", "content"
+
+    def __init__(self, message_id: int, author_id: int, is_bot: bool, in_guild: bool, content: str) -> None:
+        self.id: int = message_id
+        self.author = SimpleNamespace(id = author_id, bot = is_bot)
+        self.guild = SimpleNamespace(id = 1) if in_guild else None
+        self.content: str = content
+
+    async def reply(self, *args, **kwargs) -> "FakeMessage":
+        return self
+
+    async def delete(self) -> None:
+        pass
+
+class FakeSocket:
+
+    __slots__ = "sent",
+
+    def __init__(self) -> None:
+        self.sent: int = 0
+
+    async def send(self, data: str) -> None:
+        self.sent += 1
+
+class FakeBot:
+    """
+    Stands in for the gateway side of the bot. get_context does a bit of work like the real prefix parsing does.
+    """
+
+    __slots__ = "context_calls",
+
+    def __init__(self) -> None:
+        self.context_calls: int = 0
+
+    async def get_context(self, message: FakeMessage) -> SimpleNamespace:
+        self.context_calls += 1
+        await asyncio.sleep(0)
+        return SimpleNamespace(command = None, prefix = "?" if message.content.startswith("?") else None)
+
+def fake_gateway(event_count: int, guild_share: float, bot_share: float, seed: int = 0) -> list[FakeMessage]:
+    rng = random.Random(seed)
+    events: list[FakeMessage] = []
+    for i in range(event_count):
+        roll: float = rng.random()
+        # Every direct message gets its own author so none of them are rejected for waiting on a reply.
+        events.append(FakeMessage(
+            message_id = i,
+            author_id = i,
+            is_bot = guild_share <= roll < guild_share + bot_share,
+            in_guild = roll < guild_share,
+            content = "How do I make a class in Java?"
+        ))
+    return events
+
+async def benchmark(event_count: int = 100_000, guild_share: float = 0.9, bot_share: float = 0.05) -> None:
+    bot = FakeBot()
+    listener = Listener(bot)
+    listener.socket = FakeSocket()
+
+    events: list[FakeMessage] = fake_gateway(event_count, guild_share, bot_share)
+
+    start: float = perf_counter()
+    for message in events:
+        await listener.listen(message)
+    seconds: float = perf_counter() - start
+
+    print(f"Events:               {event_count}")
+    print(f"Guild / bot share:    {guild_share:.0%} / {bot_share:.0%}")
+    print(f"Context parses:       {bot.context_calls}")
+    print(f"Prompts forwarded:    {listener.socket.sent}")
+    print(f"Seconds:              {seconds:.3f}")
+    print(f"Events per second:    {event_count / seconds:,.0f}")
+
+if __name__ == "__main__":
+    asyncio.run(benchmark())
@@ -1,8 +1,16 @@
-from haystack.document_stores.in_memory import InMemoryDocumentStore
-from haystack.dataclasses import Document
+import sys
+from typing import Any
 
-from parsing import parse_directory
-from haystack_server.lib import LLamaCpp, LLMResult
+from llamacpp_server.startup import StartupProfiler
+
+# python -m haystack_server --profile-startup prints how long every import and startup phase took once the model is loaded.
+# Created before anything heavy is imported, so those imports are timed too.
+profiler = StartupProfiler("--profile-startup" in sys.argv[1:])
+
+with profiler.phase("imports"):
+    from parsing import parse_directory
+    from haystack_server.lib import LLamaCpp, LLMResult
+    from llamacpp_server.runtime_config import load_runtime_config
 
 prompt_template = """\
 You are a student assistant. You must answer in a way that helps students arrive at the correct answer themselves.
@@ -25,17 +33,30 @@ prompt = "How can I create a class in Java that represents a celestial body, and
 document_directory: str
 llm_path: str = "D:/LLM/orca-2-7b.Q4_K_M.gguf"
 
+# Written by python -m llamacpp_server.testing.autotune. Parameters set in it override model_kwargs below.
+runtime_config_path: str = "runtime.toml"
+
 def main() -> None:
 
+    with profiler.phase("document store imports"):
+        from haystack.document_stores.in_memory import InMemoryDocumentStore
+        from haystack.dataclasses import Document
+
     # Laste inn all fagstoff data
-    documents: list[Document] = []
-    for file_path, text in parse_directory(document_directory).items():
-        documents.append(Document(id = file_path, content = text))
+    with profiler.phase("index build"):
+        documents: list[Document] = []
+        for file_path, text in parse_directory(document_directory).items():
+            documents.append(Document(id = file_path, content = text))
+
+        document_store = InMemoryDocumentStore()
+        document_store.write_documents(documents = documents)
 
-    document_store = InMemoryDocumentStore()
-    document_store.write_documents(documents = documents)
+    with profiler.phase("runtime config"):
+        model_kwargs: dict[str, Any] = {"n_gpu_layers": -1, "n_ctx": 500} | load_runtime_config(runtime_config_path)
 
-    llm = LLamaCpp(llm_path, model_kwargs = {"n_gpu_tokens": -1, "n_ctx": 500})
+    with profiler.phase("model load"):
+        llm = LLamaCpp(llm_path, model_kwargs = model_kwargs)
+    profiler.report()
 
     result: LLMResult = llm.run_with_bm25(
         prompt_template = prompt_template,
@@ -51,7 +72,12 @@ def main() -> None:
 
 def main2() -> None:
 
-    llm = LLamaCpp(llm_path, model_kwargs = {"n_gpu_tokens": -1, "n_ctx": 500})
+    with profiler.phase("runtime config"):
+        model_kwargs: dict[str, Any] = {"n_gpu_layers": -1, "n_ctx": 500} | load_runtime_config(runtime_config_path)
+
+    with profiler.phase("model load"):
+        llm = LLamaCpp(llm_path, model_kwargs = model_kwargs)
+    profiler.report()
 
     result: LLMResult = llm.run(
         prompt_template = prompt_template,
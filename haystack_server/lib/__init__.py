@@ -1,2 +1,3 @@
+from .cache import *
 from .database import *
 from .models import *
\ No newline at end of file
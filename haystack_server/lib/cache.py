@@ -0,0 +1,71 @@
+import re
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, TypeVar
+
+__all__ = "RetrievalCache", "bag_of_words"
+
+T = TypeVar("T")
+
+# Same tokenization as Haystack's in-memory BM25, so queries with the same key always get the same documents.
+word_pattern: re.Pattern = re.compile(r"(?u)\b\w\w+\b")
+
+def bag_of_words(text: str) -> tuple[str, ...]:
+    """
+    The query as BM25 sees it. Case, punctuation and word order don't change BM25 scores, so they don't change the key either.
+    """
+
+    return tuple(sorted(word_pattern.findall(text.lower())))
+
+class RetrievalCache:
+    """
+    Least recently used cache of retrieval results.
+
+    Keys must include a version of whatever was searched, so results from before the documents changed are
+    never returned. Stale entries are not removed eagerly, they just stop being hit and get evicted.
+    Safe to use from several threads.
+    """
+
+    __slots__ = "max_entries", "hits", "misses", "_entries", "_lock"
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries: int = max_entries
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], T]) -> T:
+        """
+        Return the cached result for key, or compute and cache it. compute runs outside the lock,
+        so two threads missing on the same key at once both compute it.
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        value: T = compute()
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float | None:
+        lookups: int = self.hits + self.misses
+        return None if lookups == 0 else self.hits / lookups
+
+    def __len__(self) -> int:
+        return len(self._entries)
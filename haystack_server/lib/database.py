@@ -1,9 +1,13 @@
-import json
+import json, os
 from enum import StrEnum
-from typing import Self
+from typing import TYPE_CHECKING, Self
 
 from jsonschema import Draft202012Validator
-from haystack.dataclasses import Document
+
+if TYPE_CHECKING:
+    from haystack.dataclasses import Document
+
+from .cache import RetrievalCache
 
 __all__ = "Database",
 
@@ -60,7 +64,9 @@ class Link:
         self.location: str = location
         self.location_type: LocationType = location_type
 
-    def read_document(self) -> Document:
+    def read_document(self) -> "Document":
+        from haystack.dataclasses import Document
+
         match self.location_type:
             case LocationType.FILE:
                 with open(self.location, "r") as file:
@@ -101,16 +107,25 @@ class Subject:
 class Database:
     """
     Represents a simple database that can fetch documents for use with haystack.
+
+    Results are cached per subject and set of words in the question, since students mostly ask about the same few
+    assignments. The index file is reloaded, and the cache with it, as soon as the file changes. Call update_data
+    to drop cached documents after editing a linked file without touching the index.
     """
 
-    __slots__ = "index_path", "subjects"
+    __slots__ = "index_path", "subjects", "version", "cache", "_index_mtime"
 
-    def __init__(self, index_path: str) -> None:
+    def __init__(self, index_path: str, cache_size: int = 1024) -> None:
         self.index_path: str = index_path
         self.subjects: list[Subject] = []
+        # Bumped on every reload. Part of every cache key, so entries from an older index are never hit again.
+        self.version: int = 0
+        self.cache = RetrievalCache(cache_size)
+        self._index_mtime: int | None = None
         self.update_data()
 
     def update_data(self) -> None:
+        mtime: int = os.stat(self.index_path).st_mtime_ns
         with open(self.index_path, "r") as file:
             index_data: dict[str, list] = json.load(file)
 
@@ -120,8 +135,24 @@ class Database:
             Subject.from_raw_links(subject_name, links)
             for subject_name, links in index_data.items()
         ]
+        self._index_mtime = mtime
+        self.version += 1
+
+    def refresh(self) -> None:
+        """
+        Reload the index if the file changed since it was last loaded.
+        """
+
+        if os.stat(self.index_path).st_mtime_ns != self._index_mtime:
+            self.update_data()
+
+    def fetch_relevant_documents(self, subject_name: str, text: str) -> list["Document"]:
+        self.refresh()
+        # Links match on whole whitespace separated words, so only the set of words decides the result.
+        key: tuple = (self.version, subject_name, frozenset(text.split()))
+        return list(self.cache.get_or_compute(key, lambda: self._fetch_relevant_documents(subject_name, text)))
 
-    def fetch_relevant_documents(self, subject_name: str, text: str) -> list[Document]:
+    def _fetch_relevant_documents(self, subject_name: str, text: str) -> list["Document"]:
         for subject in self.subjects:
             if subject.name == subject_name:
                 return [
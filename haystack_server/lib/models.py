@@ -1,13 +1,17 @@
-from typing import Any, Self, Sequence
+from typing import TYPE_CHECKING, Any, Self, Sequence
 from abc import abstractmethod, ABCMeta
 from dataclasses import dataclass
+from itertools import count
 from time import perf_counter
+from weakref import ref
 
-from haystack.dataclasses import Document
-from haystack.components.builders import PromptBuilder
-from haystack_integrations.components.generators.llama_cpp import LlamaCppGenerator
-from haystack.document_stores.in_memory import InMemoryDocumentStore
-from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
+# Haystack takes seconds to import, so it is only imported once a model is created or run.
+if TYPE_CHECKING:
+    from haystack.dataclasses import Document
+    from haystack_integrations.components.generators.llama_cpp import LlamaCppGenerator
+    from haystack.document_stores.in_memory import InMemoryDocumentStore
+
+from .cache import RetrievalCache, bag_of_words
 
 __all__ = "LLMResult", "LLM", "LLamaCpp"
 
@@ -30,9 +34,29 @@ class LLMResult:
 type SupportedGenerator = (
     LlamaCppGenerator
 )
-supported_generators: tuple[type] = (
-    LlamaCppGenerator,
-)
+def supported_generators() -> tuple[type, ...]:
+    from haystack_integrations.components.generators.llama_cpp import LlamaCppGenerator
+
+    return (
+        LlamaCppGenerator,
+    )
+
+# Numbers that are never reused, unlike id(), so cached results can't be mistaken for those of a newer store.
+# The weak reference tells a live store apart from a dead one whose id was handed to a new store.
+store_numbers: dict[int, tuple[ref, int]] = {}
+next_store_number = count()
+
+def document_store_version(document_store: "InMemoryDocumentStore") -> tuple[int, int]:
+    """
+    Identifies the contents of a document store well enough to cache searches over it.
+    Writing or deleting documents changes the count. Overwriting documents in place doesn't,
+    so clear the retrieval cache after doing that.
+    """
+
+    entry: tuple[ref, int] | None = store_numbers.get(id(document_store))
+    if entry is None or entry[0]() is not document_store:
+        entry = store_numbers[id(document_store)] = ref(document_store), next(next_store_number)
+    return entry[1], document_store.count_documents()
 
 class LLM(metaclass = ABCMeta):
     """
@@ -53,7 +77,9 @@ class LLM(metaclass = ABCMeta):
     @classmethod
     @abstractmethod
     def from_generator(cls, generator: SupportedGenerator) -> Self:
-        if type(generator) not in supported_generators:
+        from haystack_integrations.components.generators.llama_cpp import LlamaCppGenerator
+
+        if type(generator) not in supported_generators():
             raise ValueError(f"Generator type {type(generator)} is not supported.")
 
         if isinstance(generator, LlamaCppGenerator):
@@ -69,7 +95,7 @@ class LLM(metaclass = ABCMeta):
         ...
 
     @abstractmethod
-    def run_with_docs(self, prompt_template: str, prompt: str, documents: Sequence[Document], generation_kwargs: dict[str, Any] | None = None) -> LLMResult:
+    def run_with_docs(self, prompt_template: str, prompt: str, documents: Sequence["Document"], generation_kwargs: dict[str, Any] | None = None) -> LLMResult:
         """
         prompt_template: A string that uses the Jinja2 formatting like in Haystack. {{prompt}} marks the location of the prompt input.
         prompt: The prompt input in pure text.
@@ -79,7 +105,7 @@ class LLM(metaclass = ABCMeta):
         ...
 
     @abstractmethod
-    def run_with_bm25(self, prompt_template: str, prompt: str, document_store: InMemoryDocumentStore, document_count: int = 3, generation_kwargs: dict[str, Any] | None = None) -> LLMResult:
+    def run_with_bm25(self, prompt_template: str, prompt: str, document_store: "InMemoryDocumentStore", document_count: int = 3, generation_kwargs: dict[str, Any] | None = None) -> LLMResult:
         """
         prompt_template: A string that uses the Jinja2 formatting like in Haystack. {{prompt}} marks the location of the prompt input.
         prompt: The prompt input in pure text.
@@ -90,25 +116,32 @@ class LLM(metaclass = ABCMeta):
 
 class LLamaCpp(LLM):
 
-    __slots__ = "generator", "model_path"
+    __slots__ = "generator", "model_path", "retrieval_cache"
 
     def __init__(self, *args, **kwargs) -> None:
+        from haystack_integrations.components.generators.llama_cpp import LlamaCppGenerator
+
         self.generator: LlamaCppGenerator = LlamaCppGenerator(*args, **kwargs)
         self.model_path: str = self.generator.model_path
+        # BM25 results of run_with_bm25, keyed on the document store's version and the words of the prompt.
+        self.retrieval_cache = RetrievalCache()
 
         self.generator.warm_up()
 
     @classmethod
-    def from_generator(cls, generator: LlamaCppGenerator) -> Self:
+    def from_generator(cls, generator: "LlamaCppGenerator") -> Self:
         self = object.__new__(cls)
         self.generator = generator
         self.model_path = self.generator.model_path
+        self.retrieval_cache = RetrievalCache()
 
         self.generator.warm_up()
         return self
 
     def run(self, prompt_template: str, prompt: str, generation_kwargs: dict[str, Any] | None = None) -> LLMResult:
 
+        from haystack.components.builders import PromptBuilder
+
         prompt_builder = PromptBuilder(prompt_template)
         new_prompt: str = prompt_builder.run(prompt = prompt)["prompt"]
 
@@ -129,7 +162,9 @@ class LLamaCpp(LLM):
             #generation_kwargs = dict((f, getattr(self.generator.model.context_params, f)) for f, _ in self.generator.model.context_params._fields_)
         )
 
-    def run_with_docs(self, prompt_template: str, prompt: str, documents: Sequence[Document], generation_kwargs: dict[str, Any] | None = None) -> LLMResult:
+    def run_with_docs(self, prompt_template: str, prompt: str, documents: Sequence["Document"], generation_kwargs: dict[str, Any] | None = None) -> LLMResult:
+
+        from haystack.components.builders import PromptBuilder
 
         prompt_builder = PromptBuilder(prompt_template)
         new_prompt: str = prompt_builder.run(prompt = prompt, documents = documents)["prompt"]
@@ -151,10 +186,14 @@ class LLamaCpp(LLM):
             # generation_kwargs = dict((f, getattr(self.generator.model.context_params, f)) for f, _ in self.generator.model.context_params._fields_)
         )
 
-    def run_with_bm25(self, prompt_template: str, prompt: str, document_store: InMemoryDocumentStore, document_count: int = 3, generation_kwargs: dict[str, Any] | None = None) -> LLMResult:
+    def run_with_bm25(self, prompt_template: str, prompt: str, document_store: "InMemoryDocumentStore", document_count: int = 3, generation_kwargs: dict[str, Any] | None = None) -> LLMResult:
+        from haystack.components.builders import PromptBuilder
+        from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
 
-        document_retriever = InMemoryBM25Retriever(document_store)
-        relevant_documents: list[Document] = document_retriever.run(query = prompt, top_k = document_count)["documents"]
+        relevant_documents: list[Document] = list(self.retrieval_cache.get_or_compute(
+            (document_store_version(document_store), document_count, bag_of_words(prompt)),
+            lambda: InMemoryBM25Retriever(document_store).run(query = prompt, top_k = document_count)["documents"]
+        ))
 
         #print(relevant_documents[0].id)
 
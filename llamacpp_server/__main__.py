@@ -1,14 +1,157 @@
-import asyncio
+import asyncio, logging, sys
+from typing import Any
 
-from llamacpp_server.lib import LLM, init_server
+from llamacpp_server.startup import StartupProfiler
+
+# python -m llamacpp_server --profile-startup prints how long every import and startup phase took once the model is loaded.
+# Created before anything heavy is imported, so those imports are timed too.
+profiler = StartupProfiler("--profile-startup" in sys.argv[1:])
+
+logger: logging.Logger = logging.getLogger(__name__)
 
 llm_path = "CHANGE ME"
 
-def main() -> None:
+# Set to logging.WARNING to silence the per prompt logs.
+log_level = logging.INFO
+
+# Prometheus metrics are served on http://localhost:<metrics_port>/metrics. Set to None to disable.
+metrics_port: int | None = 8900
+
+# Seconds a prompt may wait in the queue before it is dropped. The Discord bot sends its own timeout.
+request_timeout: float | None = 600
+
+# Speculative decoding. "prompt_lookup" needs no extra model and suits answers that quote the question,
+# "draft_model" needs a small model with the same vocabulary at draft_model_path. Set to None to disable.
+speculative: str | None = "prompt_lookup"
+draft_model_path: str | None = None
+draft_tokens: int = 10
+
+# Lock the model weights in RAM so the OS can't page them out between requests.
+use_mlock: bool = False
+
+# Written by python -m llamacpp_server.testing.autotune. Parameters set in it override the defaults in run().
+runtime_config_path: str = "runtime.toml"
+
+# Summarize the older part of a conversation in idle time once it grows past this many tokens. Set to None to disable.
+summarize_after_tokens: int | None = 384
+
+# Directory of course material (pdf, docx and txt) to look up passages in for every prompt. Set to None to disable.
+document_directory: str | None = None
+# The most tokens of course material to put in a prompt.
+context_tokens: int = 256
+# An embedding model for dense retrieval, which also finds passages that use other words than the question.
+# The passages are embedded once into embedding_index_path.npy and .json. Delete those to embed again after the
+# material changes. Set to None to use keyword retrieval only.
+embedding_model_path: str | None = None
+embedding_index_path: str = "embeddings"
+# Fuse dense and keyword rankings, so exact names of classes and errors still rank first.
+hybrid_retrieval: bool = True
+# Questions whose retrieved passages are kept in memory. Set to 0 to disable.
+retrieval_cache_size: int = 1024
+
+# SQLite database every question and answer is stored in. Older messages.csv files can be added to it with
+# ConversationLog(log_path).import_legacy("messages.csv"). Set to None to store nothing.
+log_path: str | None = "messages.sqlite3"
+# Seconds between checkpoints of the conversation histories, which let students continue their conversations
+# after a restart. Conversations older than restore_max_age seconds are not restored. Set to None to start empty.
+checkpoint_interval: float | None = 300
+restore_max_age: float = 12 * 3600
+
+# Shorten answers and history as the queue grows, so everyone gets an answer quickly during assignment deadlines.
+adaptive_quality: bool = True
+# A smaller model with the same prompt format, used at the lowest quality level. Set to None to keep the main model.
+fallback_llm_path: str | None = None
+
+# Users take turns with the LLM, each turn worth this many estimated prompt and answer tokens.
+fair_share_quantum: float = 512
+# Average tokens per second, and tokens at once, each student may spend. Set to None to disable.
+# Limits apply per user id, since the Discord bot sends every student's prompts over the same connection.
+rate_limit_tokens_per_second: float | None = 20
+rate_limit_burst: float = 4096
+
+# Secret the Discord bot must send to load another model while the server is running. Admin messages are refused
+# while it is None. Pick a long random string and set the same admin_token in the bot's config.toml.
+admin_token: str | None = None
 
-    llm = LLM(llm_path, n_gpu_layers = -1, n_ctx = 1024, n_batch = 256, stop = "###")
+async def run() -> None:
+
+    # Imported here rather than at the top so the profiler sees them.
+    with profiler.phase("imports"):
+        from llamacpp_server.runtime_config import load_runtime_config
+        from llamacpp_server.lib import ModelManager, QualityPolicy, RateLimiter, HistoryCompactor, ConversationLog, Retriever, CachedRetriever, load_retriever, init_server, configure_logging
+
+    configure_logging(log_level)
+
+    with profiler.phase("runtime config"):
+        runtime_kwargs: dict[str, Any] = {"n_gpu_layers": -1, "n_ctx": 1024, "n_batch": 256, "use_mmap": True, "use_mlock": use_mlock} | load_runtime_config(runtime_config_path)
+
+    # Only creates the managers. The models themselves are loaded in the model load phase.
+    with profiler.phase("model manager setup"):
+        models = ModelManager(
+            speculative = speculative,
+            draft_model_path = draft_model_path,
+            draft_tokens = draft_tokens,
+            stop = "###",
+            **runtime_kwargs
+        )
+        fallback_models: ModelManager | None = None if fallback_llm_path is None else ModelManager("fallback", stop = "###", **runtime_kwargs)
+
+    compactor: HistoryCompactor | None = None if summarize_after_tokens is None else HistoryCompactor(summarize_after_tokens)
+
+    # Indexing is quick next to loading a model, but parsing pdfs and embedding still shouldn't block the event loop.
+    with profiler.phase("index build"):
+        retriever: Retriever | None = None if document_directory is None else await asyncio.to_thread(load_retriever, document_directory, embedding_model_path, embedding_index_path, hybrid_retrieval)
+    if retriever is not None and retrieval_cache_size > 0:
+        retriever = CachedRetriever(retriever, retrieval_cache_size)
+
+    with profiler.phase("conversation log"):
+        conversation_log: ConversationLog | None = None if log_path is None else ConversationLog(log_path)
+
+    async def load_model() -> None:
+        # The server keeps running without a model, reports ready: false and waits for a load_model admin message.
+        try:
+            with profiler.phase("model load"):
+                await models.load(llm_path)
+        except Exception:
+            logger.exception("Failed to load the main model. Prompts are queued until a load_model message loads one.", extra = {"model_path": llm_path})
+        finally:
+            profiler.report()
+
+    async def load_fallback() -> None:
+        # Prompts fall back to the main model at every quality level while this is missing, so it shouldn't stop the server.
+        try:
+            await fallback_models.load(fallback_llm_path)
+        except Exception:
+            logger.exception("Failed to load the fallback model, serving everything with the main model.", extra = {"model_path": fallback_llm_path})
+
+    # Kept in variables so the tasks aren't garbage collected while they run.
+    load_task: asyncio.Task = asyncio.create_task(load_model())
+    fallback_task: asyncio.Task | None = None if fallback_models is None else asyncio.create_task(load_fallback())
+
+    # The server accepts connections while the models load and queues prompts until the main model is ready.
+    await init_server(
+        "localhost", 8899, 65536, models,
+        metrics_port = metrics_port,
+        request_timeout = request_timeout,
+        admin_token = admin_token,
+        compactor = compactor,
+        retriever = retriever,
+        context_tokens = context_tokens,
+        conversation_log = conversation_log,
+        quality = QualityPolicy() if adaptive_quality else None,
+        fallback_models = fallback_models,
+        fair_share_quantum = fair_share_quantum,
+        checkpoint_interval = checkpoint_interval,
+        restore_max_age = restore_max_age,
+        rate_limit = None if rate_limit_tokens_per_second is None else RateLimiter(rate_limit_tokens_per_second, rate_limit_burst),
+        max_tokens = 512,
+        top_p = 0.15,
+        temperature = 0.35
+    )
+
+def main() -> None:
 
-    asyncio.run(init_server("localhost", 8899, 65536, llm, max_tokens = 512, top_p = 0.15, temperature = 0.35))
+    asyncio.run(run())
 
 
 if __name__ == "__main__":
@@ -1,3 +1,15 @@
+from .metrics import *
+from .logs import *
+from ..runtime_config import *
 from .models import *
 from .client import *
+from .tracing import *
+from .scheduler import *
+from .qos import *
+from .manager import *
+from .summarizer import *
+from .retrieval import *
+from .embeddings import *
+from .conversation_log import *
+from .checkpoint import *
 from .server import *
\ No newline at end of file
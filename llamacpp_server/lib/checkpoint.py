@@ -0,0 +1,154 @@
+import logging
+from time import perf_counter, time
+
+from .metrics import registry
+from .conversation_log import ConversationLog, LogRecord
+from .summarizer import ConversationSummary, HistoryCompactor
+
+__all__ = "Checkpointer",
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+checkpoints_total = registry.counter(
+    "studassbot_checkpoints",
+    "Snapshots of conversation state written to the conversation log."
+)
+restored_users = registry.gauge(
+    "studassbot_restored_users",
+    "Conversations restored from the conversation log when the server started."
+)
+
+class Checkpointer:
+    """
+    Lets students continue their conversations after the server restarts.
+
+    Every so often the histories and summaries of recently active users are written as a checkpoint to the
+    conversation log, along with the id of the newest message they include. At startup the newest checkpoint is
+    loaded and only the messages written after it are replayed, so a restart reads a few minutes of the log
+    instead of the whole semester. Without a checkpoint, the messages of the last max_age seconds are replayed.
+
+    Conversations nobody has added to in max_age seconds are left out, since a question asked the next day rarely
+    follows up on the last one and the history would only make the prompt longer.
+    """
+
+    __slots__ = "log", "cache", "compactor", "max_age", "last_active", "_applied_id", "_written_id"
+
+    def __init__(self, log: ConversationLog, cache: dict[int, list[tuple[str, str]]], compactor: HistoryCompactor | None = None, max_age: float = 12 * 3600) -> None:
+        """
+        log: Where checkpoints are stored and messages are replayed from.
+        cache: The server's histories, filled by restore and read by write.
+        compactor: Its summaries are saved and restored along with the histories.
+        max_age: Seconds after their last message that a conversation is no longer restored.
+        """
+
+        self.log: ConversationLog = log
+        self.cache: dict[int, list[tuple[str, str]]] = cache
+        self.compactor: HistoryCompactor | None = compactor
+        self.max_age: float = max_age
+        # When each cached user last got an answer, in seconds since the epoch.
+        self.last_active: dict[int, float] = {}
+        # The newest logged message that is in the cache, and the newest one in a written checkpoint.
+        self._applied_id: int = 0
+        self._written_id: int = 0
+
+    def touch(self, user_id: int, timestamp: float | None = None, message_id: int | None = None) -> None:
+        """
+        Call when a turn is added to a user's history. message_id is the turn's id in the log, if it was logged.
+        """
+
+        self.last_active[user_id] = time() if timestamp is None else timestamp
+        if message_id is not None:
+            self._applied_id = max(self._applied_id, message_id)
+
+    def _replay(self, record: LogRecord) -> None:
+        self.cache.setdefault(record.user_id, []).append((record.question, record.answer))
+        self.touch(record.user_id, record.timestamp)
+
+    def restore(self) -> int:
+        """
+        Fill the cache from the newest checkpoint and the messages after it. Returns the number of users restored.
+        """
+
+        start: float = perf_counter()
+        cutoff: float = time() - self.max_age
+        checkpoint: tuple[int, float, dict] | None = self.log.latest_checkpoint()
+
+        replayed: int = 0
+        if checkpoint is None:
+            for record in self.log.iter_range(cutoff, float("inf")):
+                self._replay(record)
+                replayed += 1
+        else:
+            message_id, _, state = checkpoint
+            for user_id, entry in state["users"].items():
+                if entry["last_active"] < cutoff:
+                    continue
+                user_id = int(user_id)
+                self.cache[user_id] = [(question, answer) for question, answer in entry["history"]]
+                self.last_active[user_id] = entry["last_active"]
+                if self.compactor is not None and entry["summary"] is not None:
+                    self.compactor.summaries[user_id] = ConversationSummary(*entry["summary"])
+
+            for record in self.log.iter_after(message_id):
+                # Records imported from the legacy csv file have no time and don't belong to a live conversation.
+                if record.timestamp is not None:
+                    self._replay(record)
+                    replayed += 1
+
+        if self.compactor is not None:
+            for user_id in self.cache:
+                self.compactor.mark(user_id)
+
+        self._applied_id = self._written_id = self.log.last_id()
+        restored_users.set(len(self.cache))
+        logger.info(
+            "Restored conversations.",
+            extra = {"users": len(self.cache), "replayed_messages": replayed, "from_checkpoint": checkpoint is not None, "seconds": round(perf_counter() - start, 3)}
+        )
+        return len(self.cache)
+
+    def snapshot(self) -> tuple[int, dict] | None:
+        """
+        The state to checkpoint and the id of the newest message it includes, or None if nothing was added since
+        the last checkpoint. Must run on the thread that adds turns to the cache, so the two agree.
+        """
+
+        if self._applied_id == self._written_id:
+            return None
+
+        cutoff: float = time() - self.max_age
+        summaries: dict[int, ConversationSummary] = {} if self.compactor is None else dict(self.compactor.summaries)
+        users: dict[str, dict] = {}
+        for user_id, history in list(self.cache.items()):
+            last_active: float = self.last_active.get(user_id, 0.0)
+            if last_active < cutoff:
+                continue
+            summary: ConversationSummary | None = summaries.get(user_id)
+            users[str(user_id)] = {
+                "last_active": last_active,
+                "history": list(history),
+                "summary": None if summary is None else [summary.text, summary.covered_turns]
+            }
+
+        return self._applied_id, {"users": users}
+
+    def save(self, message_id: int, state: dict) -> None:
+        """
+        Write a snapshot to the log. Can run on the log's own thread.
+        """
+
+        self.log.write_checkpoint(message_id, state)
+        self._written_id = max(self._written_id, message_id)
+        checkpoints_total.inc()
+        logger.info("Wrote checkpoint.", extra = {"users": len(state["users"]), "message_id": message_id})
+
+    def write(self) -> bool:
+        """
+        Snapshot and save in one go. Returns whether a checkpoint was written.
+        """
+
+        snapshot: tuple[int, dict] | None = self.snapshot()
+        if snapshot is None:
+            return False
+        self.save(*snapshot)
+        return True
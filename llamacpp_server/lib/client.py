@@ -11,16 +11,33 @@ Schema: TypeAlias = dict[str, Union[str, "Schema"]]
 schema: Schema = {
     "type": "object",
     "properties": {
+        "type": {"enum": ["queued", "started", "expired", "rate_limited", "reply"]},
         "id": {"type": "number"},
-        "text": {"type": "string"}
+        "request_id": {"type": "string"},
+        "text": {"type": "string"},
+        "position": {"type": "integer"},
+        "ready": {"type": "boolean"},
+        "quality": {"type": "string"},
+        "retry_after": {"type": "number"},
+        "spans": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "start": {"type": "number"},
+                    "duration": {"type": "number"}
+                }
+            }
+        }
     },
     "additionalProperties": False
 }
 
-def prompt_send_receive(sock: socket, user_id: int, prompt: str) -> str:
+def prompt_send_receive(sock: socket, user_id: int, prompt: str) -> str | None:
     """
     Send prompt to server and expect a reply from LLM.
-    Return the reply string.
+    Return the reply string, or None if the prompt expired, was rate limited or the reply couldn't be read.
     """
 
     try:
@@ -31,6 +48,17 @@ def prompt_send_receive(sock: socket, user_id: int, prompt: str) -> str:
         data: Any = loads(received_data)
         validate(data, schema)
 
+        # Skip the status messages about the prompt's place in the queue.
+        while data.get("type", "reply") != "reply":
+            if data["type"] == "expired":
+                print("Prompt expired before the server got to it.")
+                return None
+            if data["type"] == "rate_limited":
+                print(f"Sending prompts too fast, try again in {data['retry_after']} seconds.")
+                return None
+            data = loads(sock.recv(4096))
+            validate(data, schema)
+
         return data["text"]
 
     except UnicodeDecodeError:
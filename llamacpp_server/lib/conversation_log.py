@@ -0,0 +1,200 @@
+import csv, json, sqlite3
+from contextlib import closing
+from dataclasses import dataclass, astuple, fields
+from itertools import groupby, islice
+from time import time
+from typing import Iterable, Iterator
+
+__all__ = "LogRecord", "ConversationLog"
+
+# One question and answer as stored in the log. timestamp is None for records imported from the legacy csv file.
+@dataclass(slots = True)
+class LogRecord:
+    id: int
+    user_id: int
+    timestamp: float | None
+    request_id: str | None
+    question: str
+    answer: str
+
+schema: str = """\
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    timestamp REAL,
+    request_id TEXT,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_user_time ON messages (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS messages_time ON messages (timestamp);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    id INTEGER PRIMARY KEY,
+    message_id INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    state TEXT NOT NULL
+);
+"""
+
+columns: str = ", ".join(field.name for field in fields(LogRecord))
+
+class ConversationLog:
+    """
+    Every question and answer the server has handled, in an SQLite database indexed on user and time.
+
+    Writes go through one connection owned by the server, which may move between threads but must only be used by
+    one at a time. The server writes from a thread of its own. Queries open their own read connection and stream rows
+    as they are iterated, so they can run in other threads or processes while the server writes, and analysing a
+    whole semester never needs more than one row in memory at a time.
+    """
+
+    __slots__ = "path", "_connection"
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self._connection = sqlite3.connect(path, check_same_thread = False)
+        # Readers don't block the writer and the other way round. NORMAL is durable enough for a log in WAL mode.
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript(schema)
+
+    def append(self, user_id: int, question: str, answer: str, request_id: str | None = None, timestamp: float | None = None) -> int:
+        """
+        Store a question and answer and return the id of its record.
+        """
+
+        with self._connection:
+            cursor: sqlite3.Cursor = self._connection.execute(
+                "INSERT INTO messages (user_id, timestamp, request_id, question, answer) VALUES (?, ?, ?, ?, ?)",
+                (user_id, time() if timestamp is None else timestamp, request_id, question, answer)
+            )
+        return cursor.lastrowid
+
+    def import_legacy(self, file_path: str, batch_size: int = 1000) -> int:
+        """
+        Import a messages.csv file written by older versions of the server. Returns the number of records imported.
+        The file is read in chunks. Importing the same file twice imports its records twice.
+        """
+
+        from parsing import iter_test_data
+
+        records: Iterator[tuple[int, str, str]] = iter_test_data(file_path)
+        count: int = 0
+        with self._connection:
+            while len(batch := list(islice(records, batch_size))) > 0:
+                self._connection.executemany("INSERT INTO messages (user_id, question, answer) VALUES (?, ?, ?)", batch)
+                count += len(batch)
+        return count
+
+    def _query(self, sql: str, parameters: tuple = ()) -> Iterator[LogRecord]:
+        with closing(sqlite3.connect(f"file:{self.path}?mode=ro", uri = True)) as connection:
+            for row in connection.execute(sql, parameters):
+                yield LogRecord(*row)
+
+    def iter_all(self) -> Iterator[LogRecord]:
+        return self._query(f"SELECT {columns} FROM messages ORDER BY id")
+
+    def iter_user(self, user_id: int, since: float | None = None) -> Iterator[LogRecord]:
+        """
+        A user's records, oldest first. since skips records from before that time, including all legacy records.
+        """
+
+        if since is None:
+            return self._query(f"SELECT {columns} FROM messages WHERE user_id = ? ORDER BY timestamp, id", (user_id,))
+        return self._query(f"SELECT {columns} FROM messages WHERE user_id = ? AND timestamp >= ? ORDER BY timestamp, id", (user_id, since))
+
+    def iter_range(self, start: float, end: float) -> Iterator[LogRecord]:
+        """
+        Records from start up to, but not including, end. Legacy records have no time and are never included.
+        """
+
+        return self._query(f"SELECT {columns} FROM messages WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp, id", (start, end))
+
+    def iter_after(self, message_id: int) -> Iterator[LogRecord]:
+        """
+        Records written after the record with the given id, in the order they were written.
+        """
+
+        return self._query(f"SELECT {columns} FROM messages WHERE id > ? ORDER BY id", (message_id,))
+
+    def iter_newest(self, count: int) -> Iterator[LogRecord]:
+        """
+        The newest count records, oldest first. Reads only those rows instead of the whole log.
+        """
+
+        return self._query(f"SELECT {columns} FROM (SELECT {columns} FROM messages ORDER BY id DESC LIMIT ?) ORDER BY id", (count,))
+
+    def iter_conversations(self) -> Iterator[tuple[int, Iterator[LogRecord]]]:
+        """
+        Every user with their records, oldest first. Like groupby, each user's records must be consumed before the next user's.
+        """
+
+        records: Iterator[LogRecord] = self._query(f"SELECT {columns} FROM messages ORDER BY user_id, timestamp, id")
+        return groupby(records, key = lambda record: record.user_id)
+
+    def user_ids(self) -> Iterator[int]:
+        with closing(sqlite3.connect(f"file:{self.path}?mode=ro", uri = True)) as connection:
+            for row in connection.execute("SELECT DISTINCT user_id FROM messages ORDER BY user_id"):
+                yield row[0]
+
+    def last_id(self) -> int:
+        """
+        The id of the newest record, or 0 if the log is empty.
+        """
+
+        return self._connection.execute("SELECT coalesce(max(id), 0) FROM messages").fetchone()[0]
+
+    def write_checkpoint(self, message_id: int, state: dict) -> None:
+        """
+        Store a snapshot of server state that is up to date with every record up to message_id.
+        Only the newest checkpoint is kept.
+        """
+
+        with self._connection:
+            cursor: sqlite3.Cursor = self._connection.execute(
+                "INSERT INTO checkpoints (message_id, timestamp, state) VALUES (?, ?, ?)",
+                (message_id, time(), json.dumps(state, ensure_ascii = False))
+            )
+            self._connection.execute("DELETE FROM checkpoints WHERE id < ?", (cursor.lastrowid,))
+
+    def latest_checkpoint(self) -> tuple[int, float, dict] | None:
+        """
+        The message id, time and state of the newest checkpoint, or None if none has been written.
+        """
+
+        row: tuple[int, float, str] | None = self._connection.execute(
+            "SELECT message_id, timestamp, state FROM checkpoints ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def export_jsonl(self, file_path: str, records: Iterable[LogRecord] | None = None) -> int:
+        """
+        Write records, or the whole log, to a JSON lines file one record at a time. Returns the number written.
+        """
+
+        count: int = 0
+        with open(file_path, "w", encoding = "utf-8") as file:
+            for record in self.iter_all() if records is None else records:
+                file.write(json.dumps({field.name: getattr(record, field.name) for field in fields(LogRecord)}, ensure_ascii = False))
+                file.write("\n")
+                count += 1
+        return count
+
+    def export_csv(self, file_path: str, records: Iterable[LogRecord] | None = None) -> int:
+        """
+        Write records, or the whole log, to a csv file with a header row, one record at a time. Returns the number written.
+        """
+
+        count: int = 0
+        with open(file_path, "w", encoding = "utf-8", newline = "") as file:
+            writer = csv.writer(file)
+            writer.writerow(field.name for field in fields(LogRecord))
+            for record in self.iter_all() if records is None else records:
+                writer.writerow(astuple(record))
+                count += 1
+        return count
+
+    def close(self) -> None:
+        self._connection.close()
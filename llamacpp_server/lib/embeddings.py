@@ -0,0 +1,215 @@
+import json, os
+from threading import Lock
+from typing import Hashable, Protocol, Self
+
+import numpy as np
+import numpy.typing as npt
+from llama_cpp import Llama
+
+from .retrieval import Retriever, BM25Retriever
+
+__all__ = "Embedder", "EmbeddingIndex", "EmbeddingRetriever", "split_passages", "load_retriever"
+
+class TextEmbedder(Protocol):
+    def embed(self, texts: list[str]) -> npt.NDArray[np.float32]:
+        ...
+
+class Embedder:
+    """
+    An embedding model run by llama-cpp. Runs on the CPU by default so it doesn't compete with the LLM for VRAM.
+    llama-cpp contexts aren't thread safe, so calls are serialized. Batch texts into one call instead.
+    """
+
+    __slots__ = "llm", "_lock"
+
+    def __init__(self, model_path: str, n_ctx: int = 512, n_gpu_layers: int = 0, **kwargs) -> None:
+        self.llm = Llama(model_path, embedding = True, n_ctx = n_ctx, n_batch = n_ctx, n_gpu_layers = n_gpu_layers, verbose = False, **kwargs)
+        self._lock = Lock()
+
+    def embed(self, texts: list[str]) -> npt.NDArray[np.float32]:
+        """
+        Unit length embeddings of the texts, one row each.
+        """
+
+        with self._lock:
+            vectors: npt.NDArray[np.float32] = np.asarray(self.llm.embed(texts), dtype = np.float32)
+
+        norms: npt.NDArray[np.float32] = np.linalg.norm(vectors, axis = 1, keepdims = True)
+        return vectors / np.maximum(norms, 1e-12)
+
+def split_passages(documents: dict[str, str], passage_words: int = 120, overlap_words: int = 20) -> list[str]:
+    """
+    Cut documents into overlapping passages short enough to embed, and to fit a few of in a prompt.
+    """
+
+    passages: list[str] = []
+    step: int = passage_words - overlap_words
+    for text in documents.values():
+        words: list[str] = text.split()
+        if len(words) == 0:
+            continue
+        for start in range(0, max(len(words) - overlap_words, 1), step):
+            passages.append(" ".join(words[start:start + passage_words]))
+    return passages
+
+class EmbeddingIndex:
+    """
+    Passage embeddings stored as one matrix in a .npy file next to a .json file with the passage texts.
+
+    The matrix is memory mapped, so opening an index is instant and the OS only pages in what searches touch.
+    float16 halves the file without changing the rankings noticeably, but every search has to convert the matrix
+    to float32 first, which costs several times the search itself unless queries are batched. So only store float16
+    when the float32 matrix doesn't fit in RAM.
+    """
+
+    __slots__ = "vectors", "passages"
+
+    # Rows scored at a time. Bounds the float32 copy of a float16 matrix to a few tens of MB.
+    block_rows: int = 16384
+
+    def __init__(self, vectors: npt.NDArray, passages: list[str]) -> None:
+        if len(vectors) != len(passages):
+            raise ValueError(f"{len(vectors)} vectors for {len(passages)} passages.")
+
+        self.vectors: npt.NDArray = vectors
+        self.passages: list[str] = passages
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(f"{path}.npy") and os.path.exists(f"{path}.json")
+
+    @classmethod
+    def open(cls, path: str) -> Self:
+        with open(f"{path}.json", "r", encoding = "utf-8") as file:
+            passages: list[str] = json.load(file)
+        return cls(np.load(f"{path}.npy", mmap_mode = "r"), passages)
+
+    @classmethod
+    def build(cls, embedder: TextEmbedder, passages: list[str], path: str, dtype: npt.DTypeLike = np.float32, batch_size: int = 32) -> Self:
+        """
+        Embed every passage once and write the index to path.npy and path.json.
+        The texts are written last, so an interrupted build is never mistaken for a finished one.
+        """
+
+        if len(passages) == 0:
+            raise ValueError("Can't build an index without passages.")
+
+        vectors: npt.NDArray | None = None
+        for start in range(0, len(passages), batch_size):
+            batch: npt.NDArray[np.float32] = embedder.embed(passages[start:start + batch_size])
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(f"{path}.npy", mode = "w+", dtype = dtype, shape = (len(passages), batch.shape[1]))
+            vectors[start:start + len(batch)] = batch
+
+        vectors.flush()
+        del vectors
+
+        with open(f"{path}.json", "w", encoding = "utf-8") as file:
+            json.dump(passages, file)
+
+        return cls.open(path)
+
+    def search(self, queries: npt.NDArray[np.float32], top_k: int) -> tuple[npt.NDArray[np.intp], npt.NDArray[np.float32]]:
+        """
+        The top_k passages by cosine similarity for each row of unit length query vectors.
+        Returns passage indices and scores, both shaped (queries, top_k), best first.
+        """
+
+        queries = np.atleast_2d(np.asarray(queries, dtype = np.float32))
+        top_k = min(top_k, len(self.passages))
+
+        candidate_indices: list[npt.NDArray[np.intp]] = []
+        candidate_scores: list[npt.NDArray[np.float32]] = []
+
+        # Keep the best top_k of every block, then pick the best of those, so only one block is ever copied and scored at once.
+        for start in range(0, len(self.passages), self.block_rows):
+            block: npt.NDArray[np.float32] = np.asarray(self.vectors[start:start + self.block_rows], dtype = np.float32)
+            scores: npt.NDArray[np.float32] = queries @ block.T
+            k: int = min(top_k, block.shape[0])
+            best: npt.NDArray[np.intp] = np.argpartition(scores, -k, axis = 1)[:, -k:]
+            candidate_indices.append(best + start)
+            candidate_scores.append(np.take_along_axis(scores, best, axis = 1))
+
+        indices: npt.NDArray[np.intp] = np.concatenate(candidate_indices, axis = 1)
+        scores = np.concatenate(candidate_scores, axis = 1)
+        order: npt.NDArray[np.intp] = np.argsort(-scores, axis = 1)[:, :top_k]
+        return np.take_along_axis(indices, order, axis = 1), np.take_along_axis(scores, order, axis = 1)
+
+class EmbeddingRetriever:
+    """
+    Dense retrieval, which finds passages that mean the same as the question even when they share few words with it.
+
+    With hybrid on, the dense ranking is fused with a BM25 ranking of the same passages by reciprocal rank fusion,
+    so exact matches on names like classes and error messages still come out on top.
+    Ranks are fused rather than scores, since cosine similarities and BM25 scores aren't on comparable scales.
+    """
+
+    __slots__ = "index", "embedder", "top_k", "candidates", "keyword", "fusion_k"
+
+    def __init__(self, index: EmbeddingIndex, embedder: TextEmbedder, top_k: int = 3, hybrid: bool = False, candidates: int = 20, fusion_k: int = 60) -> None:
+        """
+        top_k: How many passages to retrieve per question.
+        hybrid: Fuse with BM25. Builds a BM25 index of the passages, which needs Haystack.
+        candidates: How deep into each ranking fusion looks.
+        fusion_k: Dampens the weight of the top ranks. 60 is the usual choice for reciprocal rank fusion.
+        """
+
+        self.index: EmbeddingIndex = index
+        self.embedder: TextEmbedder = embedder
+        self.top_k: int = top_k
+        self.candidates: int = max(candidates, top_k)
+        self.fusion_k: int = fusion_k
+        self.keyword: BM25Retriever | None = None
+        if hybrid:
+            self.keyword = BM25Retriever({str(i): passage for i, passage in enumerate(index.passages)}, self.candidates)
+
+    @property
+    def version(self) -> Hashable:
+        # An index is never changed after it is built.
+        return 0
+
+    def retrieve(self, text: str) -> list[str]:
+        return self.retrieve_many([text])[0]
+
+    def cache_key(self, text: str) -> Hashable:
+        # Embeddings depend on the exact text, so only whitespace at the ends is ignored.
+        return text.strip()
+
+    def retrieve_many(self, texts: list[str]) -> list[list[str]]:
+        """
+        Retrieve for many questions with one embedding call and one pass over the matrix.
+        """
+
+        indices, _ = self.index.search(self.embedder.embed(texts), self.candidates if self.keyword is not None else self.top_k)
+
+        results: list[list[str]] = []
+        for text, dense in zip(texts, indices.tolist()):
+            if self.keyword is not None:
+                dense = self.fuse(dense, [int(document_id) for document_id in self.keyword.rank(text)])
+            results.append([self.index.passages[i] for i in dense[:self.top_k]])
+        return results
+
+    def fuse(self, *rankings: list[int]) -> list[int]:
+        scores: dict[int, float] = {}
+        for ranking in rankings:
+            for rank, passage in enumerate(ranking, start = 1):
+                scores[passage] = scores.get(passage, 0.0) + 1 / (self.fusion_k + rank)
+        return sorted(scores, key = scores.__getitem__, reverse = True)
+
+def load_retriever(directory_path: str, embedding_model_path: str | None = None, index_path: str = "embeddings", hybrid: bool = True) -> Retriever:
+    """
+    BM25 retrieval over the documents in a directory, or dense retrieval if an embedding model is given.
+    The passages are embedded once into index_path.npy and .json. Delete those to embed again after the documents change.
+    """
+
+    if embedding_model_path is None:
+        return BM25Retriever.from_directory(directory_path)
+
+    from parsing import parse_directory
+
+    embedder = Embedder(embedding_model_path)
+    if EmbeddingIndex.exists(index_path):
+        index: EmbeddingIndex = EmbeddingIndex.open(index_path)
+    else:
+        index = EmbeddingIndex.build(embedder, split_passages(parse_directory(directory_path)), index_path)
+    return EmbeddingRetriever(index, embedder, hybrid = hybrid)
@@ -0,0 +1,40 @@
+import logging, sys
+
+__all__ = "configure_logging",
+
+# Attributes every LogRecord has. Anything else on a record was passed through `extra` and is printed as a field.
+_RESERVED: frozenset[str] = frozenset(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    Formats records as a single line of `key=value` pairs so they can be grepped and parsed by log tooling.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields: list[str] = [
+            f"time={self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}",
+            f"level={record.levelname.lower()}",
+            f"logger={record.name}",
+            f"event={record.getMessage()!r}",
+        ]
+        fields.extend(f"{key}={value!r}" for key, value in record.__dict__.items() if key not in _RESERVED)
+
+        line: str = " ".join(fields)
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+def configure_logging(level: int | str = logging.INFO) -> None:
+    """
+    Send the server's logs to stderr as structured key=value lines.
+    Set the level to WARNING or higher to switch off the per request logging on the hot path.
+    """
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(KeyValueFormatter())
+
+    logger: logging.Logger = logging.getLogger("llamacpp_server")
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
@@ -0,0 +1,157 @@
+import asyncio, logging
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, Iterator
+
+from .models import LLM
+from .metrics import registry
+
+__all__ = "ModelManager",
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+model_ready = registry.gauge(
+    "studassbot_model_ready",
+    "1 when a model is loaded and requests are being served, 0 while the first model is loading.",
+    ("role",)
+)
+model_load_seconds = registry.histogram(
+    "studassbot_model_load_seconds",
+    "Time spent loading and warming up a model.",
+    ("role", "outcome")
+)
+models_in_memory = registry.gauge(
+    "studassbot_models_in_memory",
+    "Models held in memory, including old models still finishing requests after a swap.",
+    ("role",)
+)
+
+class ModelManager:
+    """
+    Owns the LLM the server generates with, so it can be loaded in the background and swapped while running.
+
+    Loading happens in a thread while the server keeps accepting connections. A loaded model is warmed up with
+    a one token generation so the first student doesn't pay for paging in the weights.
+    Swapping is atomic: requests that start after the swap get the new model, requests already generating
+    finish on the old one, and the old one is freed when the last of them releases it.
+    """
+
+    __slots__ = "role", "model_kwargs", "warm_up", "loading", "_current", "_users", "_retired", "_ready"
+
+    def __init__(self, role: str = "main", warm_up: bool = True, **model_kwargs: Any) -> None:
+        """
+        role: What the model is for, like "main" or "fallback". Labels the manager's metrics.
+        warm_up: Run a one token generation after loading, before the model takes requests.
+        model_kwargs: Passed to LLM for every model loaded. use_mmap and use_mlock control how the weights are paged in.
+        """
+
+        self.role: str = role
+        self.model_kwargs: dict[str, Any] = model_kwargs
+        self.warm_up: bool = warm_up
+        self.loading: str | None = None
+
+        self._current: LLM | None = None
+        self._users: dict[int, int] = {}
+        self._retired: dict[int, LLM] = {}
+        self._ready = asyncio.Event()
+
+        model_ready.set(0, role = role)
+        models_in_memory.set_function(lambda: len(self._retired) + (self._current is not None), role = role)
+
+    @property
+    def ready(self) -> bool:
+        return self._current is not None
+
+    @property
+    def model_path(self) -> str | None:
+        return None if self._current is None else self._current.model_path
+
+    @property
+    def context_window(self) -> int:
+        """
+        n_ctx of the current model, or of the models this manager will load if none is loaded yet.
+        """
+
+        if self._current is not None:
+            return self._current.n_ctx()
+        # llama-cpp's own default.
+        return self.model_kwargs.get("n_ctx", 512)
+
+    def _load(self, model_path: str, model_kwargs: dict[str, Any]) -> LLM:
+        llm = LLM(model_path, **model_kwargs)
+        if self.warm_up:
+            llm("Hello", record_metrics = False, max_tokens = 1)
+        return llm
+
+    async def load(self, model_path: str, **model_kwargs: Any) -> float:
+        """
+        Load a model in the background and switch new requests over to it. Returns the seconds it took.
+        model_kwargs override the manager's defaults for this model only.
+        """
+
+        if self.loading is not None:
+            raise RuntimeError(f"Already loading {self.loading}.")
+
+        self.loading = model_path
+        logger.info("Loading model.", extra = {"role": self.role, "model_path": model_path})
+
+        start: float = perf_counter()
+        try:
+            llm: LLM = await asyncio.to_thread(self._load, model_path, self.model_kwargs | model_kwargs)
+        except Exception:
+            model_load_seconds.observe(perf_counter() - start, role = self.role, outcome = "error")
+            raise
+        finally:
+            self.loading = None
+
+        seconds: float = perf_counter() - start
+        model_load_seconds.observe(seconds, role = self.role, outcome = "ok")
+
+        old: LLM | None = self._current
+        self._current = llm
+        self._ready.set()
+        model_ready.set(1, role = self.role)
+
+        if old is not None:
+            self._retire(old)
+
+        logger.info("Model ready.", extra = {"role": self.role, "model_path": model_path, "seconds": round(seconds, 3)})
+        return seconds
+
+    def _retire(self, llm: LLM) -> None:
+        if self._users.get(id(llm), 0) == 0:
+            self._close(llm)
+        else:
+            self._retired[id(llm)] = llm
+            logger.info("Draining old model.", extra = {"model_path": llm.model_path, "in_flight": self._users[id(llm)]})
+
+    def _close(self, llm: LLM) -> None:
+        self._retired.pop(id(llm), None)
+        llm.close()
+        logger.info("Closed old model.", extra = {"model_path": llm.model_path})
+
+    async def wait_ready(self) -> None:
+        await self._ready.wait()
+
+    @contextmanager
+    def acquire(self) -> Iterator[LLM]:
+        """
+        Borrow the current model for one request. Only call once the manager is ready.
+        """
+
+        if self._current is None:
+            raise RuntimeError("No model is loaded yet.")
+
+        llm: LLM = self._current
+        self._users[id(llm)] = self._users.get(id(llm), 0) + 1
+        try:
+            yield llm
+        finally:
+            self._users[id(llm)] -= 1
+            if self._users[id(llm)] == 0:
+                del self._users[id(llm)]
+                if id(llm) in self._retired:
+                    self._close(llm)
+
+    def status(self) -> dict[str, Any]:
+        return {"ready": self.ready, "model_path": self.model_path, "loading": self.loading}
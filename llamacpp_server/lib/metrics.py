@@ -0,0 +1,256 @@
+import asyncio, math
+from abc import abstractmethod, ABCMeta
+from threading import Lock
+from typing import Callable, Iterable
+
+__all__ = "Counter", "Gauge", "Histogram", "MetricsRegistry", "registry", "serve_metrics"
+
+# Bucket bounds in seconds. Covers everything from a cheap prompt build to a full length generation on CPU.
+DEFAULT_TIME_BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Bucket bounds in tokens. The upper end matches the largest context sizes we run with.
+DEFAULT_TOKEN_BUCKETS: tuple[float, ...] = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs: list[str] = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return f"{{{','.join(pairs)}}}" if pairs else ""
+
+class _Metric(metaclass = ABCMeta):
+    """
+    Shared behaviour for all metric types.
+    Every child is keyed on its label values. The lock makes the metrics safe to update from the generation thread.
+    """
+
+    __slots__ = "name", "documentation", "label_names", "_lock", "_children"
+
+    metric_type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.label_names: tuple[str, ...] = tuple(label_names)
+        self._lock = Lock()
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def _key(self, labels: dict[str, object]) -> tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> Iterable[str]:
+        """
+        The metric's sample lines in the Prometheus text format.
+        """
+        ...
+
+    def render(self) -> str:
+        lines: list[str] = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """
+    A value that only ever goes up.
+    """
+
+    __slots__ = ()
+
+    metric_type: str = "counter"
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be incremented by non-negative amounts.")
+        key: tuple[str, ...] = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def value(self, **labels: object) -> float:
+        return self._children.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            children: list[tuple[tuple[str, ...], object]] = list(self._children.items())
+        for key, value in children:
+            yield f"{self.name}_total{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+class Gauge(_Metric):
+    """
+    A value that can go up and down.
+    Can also be bound to a function that is only called when the metrics are scraped.
+    """
+
+    __slots__ = "_functions",
+
+    metric_type: str = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, label_names)
+        self._functions: dict[tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: object) -> None:
+        key: tuple[str, ...] = self._key(labels)
+        with self._lock:
+            self._children[key] = value
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key: tuple[str, ...] = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: object) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels: object) -> None:
+        key: tuple[str, ...] = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def value(self, **labels: object) -> float:
+        key: tuple[str, ...] = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._children.get(key, 0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            children: dict[tuple[str, ...], object] = dict(self._children)
+            functions: dict[tuple[str, ...], Callable[[], float]] = dict(self._functions)
+        for key, function in functions.items():
+            children[key] = function()
+        for key, value in children.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+class _HistogramChild:
+
+    __slots__ = "counts", "sum", "count"
+
+    def __init__(self, bucket_count: int) -> None:
+        self.counts: list[int] = [0] * bucket_count
+        self.sum: float = 0.0
+        self.count: int = 0
+
+class Histogram(_Metric):
+    """
+    Counts observations into cumulative buckets, like a Prometheus histogram.
+    """
+
+    __slots__ = "buckets",
+
+    metric_type: str = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_TIME_BUCKETS) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels: object) -> None:
+        key: tuple[str, ...] = self._key(labels)
+        with self._lock:
+            child: _HistogramChild | None = self._children.get(key)
+            if child is None:
+                child = self._children[key] = _HistogramChild(len(self.buckets))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    child.counts[index] += 1
+                    break
+            child.sum += value
+            child.count += 1
+
+    def count(self, **labels: object) -> int:
+        child: _HistogramChild | None = self._children.get(self._key(labels))
+        return 0 if child is None else child.count
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            children: list[tuple[tuple[str, ...], list[int], float, int]] = [
+                (key, list(child.counts), child.sum, child.count)
+                for key, child in self._children.items()
+            ]
+        for key, counts, total, count in children:
+            cumulative: int = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels: str = _format_labels(self.label_names, key, 'le="' + _format_value(bound) + '"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.label_names, key)} {count}"
+
+class MetricsRegistry:
+    """
+    A collection of named metrics that can be rendered in the Prometheus text exposition format.
+    Registering a name twice returns the already registered metric, so modules can declare their metrics at import time.
+    """
+
+    __slots__ = "_metrics",
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric_type: type[_Metric], name: str, *args, **kwargs) -> _Metric:
+        metric: _Metric | None = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = metric_type(name, *args, **kwargs)
+        elif not isinstance(metric, metric_type):
+            raise ValueError(f"{name} is already registered as a {metric.metric_type}.")
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, label_names)
+
+    def histogram(self, name: str, documentation: str, label_names: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_TIME_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, label_names, buckets)
+
+    def get(self, name: str) -> _Metric | None:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+# The registry the server and the LLM wrapper record into.
+registry = MetricsRegistry()
+
+async def serve_metrics(host: str, port: int, metrics_registry: MetricsRegistry = registry) -> asyncio.Server:
+    """
+    Start a minimal HTTP server that answers GET /metrics with the registry in Prometheus text format.
+    Meant to be bound to localhost and scraped locally, so it only understands the bare minimum of HTTP.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line: bytes = await reader.readline()
+            # Skip the request headers. Nothing in them changes the response.
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts: list[str] = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", metrics_registry.render().encode("utf-8")
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"Not found.\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
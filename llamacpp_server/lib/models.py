@@ -1,14 +1,43 @@
-from typing import Iterator, Literal
+from typing import Any, Iterator, Literal
 from dataclasses import dataclass
 from time import perf_counter
 from itertools import chain
+from threading import Event
 
-from llama_cpp import Llama, CreateCompletionResponse
+import numpy as np
+import numpy.typing as npt
+from llama_cpp import Llama, CreateCompletionResponse, StoppingCriteriaList
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+from .metrics import registry, DEFAULT_TOKEN_BUCKETS
 
 
 __all__ = "StaticResult", "StreamResult", "LLM"
 
 
+generation_seconds = registry.histogram(
+    "studassbot_generation_seconds",
+    "Time spent in the LLM per generation phase.",
+    ("phase",)
+)
+generation_tokens = registry.histogram(
+    "studassbot_generation_tokens",
+    "Tokens per generation.",
+    ("kind",),
+    buckets = DEFAULT_TOKEN_BUCKETS
+)
+generated_tokens_total = registry.counter(
+    "studassbot_generated_tokens",
+    "Total number of tokens processed by the LLM.",
+    ("kind",)
+)
+draft_tokens_total = registry.counter(
+    "studassbot_draft_tokens",
+    "Tokens proposed by the speculative draft and how many of them the model accepted.",
+    ("outcome",)
+)
+
+
 # Using a dataclass to save info about each LLM prompt run.
 # Use slots for performance because there's no reason not to.
 @dataclass(slots = True)
@@ -21,7 +50,15 @@ class StaticResult:
     response_token_count: int
     total_token_count: int
     generation_time: float
-    finish_reason: Literal["stop", "length"] | None
+    finish_reason: Literal["stop", "length", "cancelled"] | None
+    prefill_time: float
+    decode_time: float
+    draft_token_count: int = 0
+    accepted_token_count: int = 0
+
+    @property
+    def acceptance_rate(self) -> float | None:
+        return None if self.draft_token_count == 0 else self.accepted_token_count / self.draft_token_count
 
 @dataclass(slots = True)
 class StreamResult:
@@ -31,22 +68,158 @@ class StreamResult:
     response_stream: Iterator[str]
 
 
+class _FirstTokenClock:
+    """
+    A stopping criterion that never stops generation, it only remembers when the first token was sampled.
+    Everything before that point is prompt evaluation (prefill), everything after is decoding.
+    """
+
+    __slots__ = "first_token"
+
+    def __init__(self) -> None:
+        self.first_token: float | None = None
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], logits: npt.NDArray[np.single]) -> bool:
+        if self.first_token is None:
+            self.first_token = perf_counter()
+        return False
+
+
+class _DraftLlama(LlamaDraftModel):
+    """
+    Drafts tokens by greedily generating with a smaller model that shares the main model's vocabulary.
+    """
+
+    __slots__ = "llama", "num_pred_tokens"
+
+    def __init__(self, model_path: str, num_pred_tokens: int, **kwargs) -> None:
+        self.llama: Llama = Llama(model_path, **kwargs)
+        self.num_pred_tokens: int = num_pred_tokens
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs: Any) -> npt.NDArray[np.intc]:
+        draft: list[int] = []
+        for token in self.llama.generate(input_ids.tolist(), temp = 0.0):
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype = np.intc)
+
+    def close(self) -> None:
+        self.llama.close()
+
+class _CountingDraftModel(LlamaDraftModel):
+    """
+    Wraps a draft model and counts how often it is asked for a draft and how many tokens it proposes.
+    llama-cpp doesn't report how many drafted tokens were accepted, but every evaluation round produces
+    exactly one token that didn't come from the draft. The accepted count is therefore the number of
+    generated tokens minus the number of rounds.
+    """
+
+    __slots__ = "draft_model", "calls", "drafted"
+
+    def __init__(self, draft_model: LlamaDraftModel) -> None:
+        self.draft_model: LlamaDraftModel = draft_model
+        self.calls: int = 0
+        self.drafted: int = 0
+
+    def reset(self) -> None:
+        self.calls = 0
+        self.drafted = 0
+
+    def accepted(self, generated_tokens: int) -> int:
+        return max(0, min(self.drafted, generated_tokens - self.calls - 1))
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs: Any) -> npt.NDArray[np.intc]:
+        draft: npt.NDArray[np.intc] = self.draft_model(input_ids, **kwargs)
+        self.calls += 1
+        self.drafted += len(draft)
+        return draft
+
+    def close(self) -> None:
+        # Prompt lookup decoding has no model of its own to close.
+        if isinstance(self.draft_model, _DraftLlama):
+            self.draft_model.close()
+
+
 class LLM(Llama):
     """
     A small wrapper class that makes the results output a bit nicer.
+
+    speculative: "prompt_lookup" drafts tokens by matching the last n-gram against earlier text in the prompt,
+        which works well for answers that quote code and identifiers from the question or history.
+        "draft_model" drafts tokens with the smaller model at draft_model_path instead.
+        Both trade extra memory (llama-cpp keeps the logits of every token) for more tokens per second.
+    ngram_size: The longest n-gram prompt lookup tries to match.
+    draft_tokens: The most tokens drafted per step.
+
+    Calling it with a cancel_event stops generation at the next token once the event is set.
+    The partial result is returned with the finish reason "cancelled".
     """
 
-    def __init__(self, model_path: str, **kwargs):
-        super().__init__(model_path, **kwargs)
+    def __init__(
+        self,
+        model_path: str,
+        speculative: Literal["prompt_lookup", "draft_model"] | None = None,
+        ngram_size: int = 2,
+        draft_tokens: int = 10,
+        draft_model_path: str | None = None,
+        **kwargs
+    ):
+        draft_model: LlamaDraftModel | None
+        match speculative:
+            case None:
+                draft_model = None
+            case "prompt_lookup":
+                draft_model = LlamaPromptLookupDecoding(max_ngram_size = ngram_size, num_pred_tokens = draft_tokens)
+            case "draft_model":
+                if draft_model_path is None:
+                    raise ValueError("A draft_model_path is required for draft model speculative decoding.")
+                draft_model = _DraftLlama(
+                    draft_model_path,
+                    draft_tokens,
+                    n_ctx = kwargs.get("n_ctx", 512),
+                    n_gpu_layers = kwargs.get("n_gpu_layers", 0),
+                    verbose = kwargs.get("verbose", True)
+                )
+            case _:
+                raise ValueError(f"{speculative} is not a supported speculative decoding mode.")
+
+        if draft_model is not None:
+            draft_model = _CountingDraftModel(draft_model)
+
+        super().__init__(model_path, draft_model = draft_model, **kwargs)
 
-    def __call__(self, prompt: str, **kwargs) -> StaticResult | StreamResult:
+    def close(self) -> None:
+        """
+        Free the model, and the draft model too when drafting with a second model, which llama-cpp leaves open.
+        """
+
+        super().close()
+        if isinstance(self.draft_model, _CountingDraftModel):
+            self.draft_model.close()
+
+    def __call__(self, prompt: str, cancel_event: Event | None = None, record_metrics: bool = True, **kwargs) -> StaticResult | StreamResult:
+        """
+        record_metrics: Whether the generation counts towards the latency and token metrics. Off for warm-ups.
+        """
+
+        clock = _FirstTokenClock()
+        stopping_criteria = StoppingCriteriaList([clock, *(kwargs.get("stopping_criteria") or ())])
+        if cancel_event is not None:
+            stopping_criteria.append(lambda input_ids, logits: cancel_event.is_set())
+        kwargs["stopping_criteria"] = stopping_criteria
+
+        if isinstance(self.draft_model, _CountingDraftModel):
+            self.draft_model.reset()
 
         start: float = perf_counter()
         raw_result: CreateCompletionResponse | Iterator[CreateCompletionResponse] = super().__call__(prompt, **kwargs)
         stop: float = perf_counter()
 
         if isinstance(raw_result, dict):
-            return StaticResult(
+            first_token: float = stop if clock.first_token is None else clock.first_token
+
+            result = StaticResult(
                 model_id = raw_result["id"],
                 model_path = raw_result["model"],
                 prompt_text = prompt,
@@ -55,8 +228,30 @@ class LLM(Llama):
                 response_token_count = raw_result["usage"]["completion_tokens"],
                 total_token_count = raw_result["usage"]["total_tokens"],
                 generation_time = stop - start,
-                finish_reason = raw_result["choices"][0]["finish_reason"]
+                finish_reason = "cancelled" if cancel_event is not None and cancel_event.is_set() else raw_result["choices"][0]["finish_reason"],
+                prefill_time = first_token - start,
+                decode_time = stop - first_token
             )
+
+            if isinstance(self.draft_model, _CountingDraftModel):
+                result.draft_token_count = self.draft_model.drafted
+                result.accepted_token_count = self.draft_model.accepted(result.response_token_count)
+
+            if not record_metrics:
+                return result
+
+            if isinstance(self.draft_model, _CountingDraftModel):
+                draft_tokens_total.inc(result.draft_token_count, outcome = "drafted")
+                draft_tokens_total.inc(result.accepted_token_count, outcome = "accepted")
+
+            generation_seconds.observe(result.prefill_time, phase = "prefill")
+            generation_seconds.observe(result.decode_time, phase = "decode")
+            generation_tokens.observe(result.prompt_token_count, kind = "prompt")
+            generation_tokens.observe(result.response_token_count, kind = "completion")
+            generated_tokens_total.inc(result.prompt_token_count, kind = "prompt")
+            generated_tokens_total.inc(result.response_token_count, kind = "completion")
+
+            return result
         else:
             first: CreateCompletionResponse = next(raw_result)
             return StreamResult(
@@ -0,0 +1,135 @@
+import logging
+from dataclasses import dataclass
+from time import perf_counter
+
+from .metrics import registry
+
+__all__ = "QualityLevel", "QualityPolicy"
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+quality_decisions = registry.counter(
+    "studassbot_quality_decisions",
+    "Requests served at each quality level.",
+    ("level",)
+)
+quality_changes = registry.counter(
+    "studassbot_quality_changes",
+    "Times the quality level was lowered or restored.",
+    ("direction",)
+)
+quality_level = registry.gauge(
+    "studassbot_quality_level",
+    "Current quality level, 0 being full quality."
+)
+smoothed_wait = registry.gauge(
+    "studassbot_smoothed_queue_wait_seconds",
+    "Exponentially weighted average of the time requests wait in the queue, as seen by the quality policy."
+)
+
+# How to answer at one level of load. None means no limit beyond the server's defaults.
+@dataclass(slots = True)
+class QualityLevel:
+    name: str
+    # The level applies once either the queue is at least this deep or the smoothed queue wait is at least this long.
+    min_queue_depth: int
+    min_wait_seconds: float
+    max_tokens: int | None = None
+    history_turns: int | None = None
+    use_fallback: bool = False
+
+default_levels: tuple[QualityLevel, ...] = (
+    QualityLevel("full", 0, 0.0),
+    QualityLevel("reduced", 3, 10.0, max_tokens = 256, history_turns = 4),
+    QualityLevel("short", 8, 30.0, max_tokens = 128, history_turns = 2),
+    QualityLevel("minimal", 16, 60.0, max_tokens = 64, history_turns = 0, use_fallback = True)
+)
+
+class QualityPolicy:
+    """
+    Trades answer length and context for latency when the queue grows, so everyone gets a short answer quickly
+    instead of a few students getting long answers while the rest wait for minutes.
+
+    Load is judged on both the queue depth and a smoothed average of how long requests waited, whichever is worse.
+    Quality drops as soon as load rises, but is only restored one level at a time after load has stayed lower for
+    recover_after requests in a row, so it doesn't flap back and forth at a threshold. Once the queue is empty
+    there is nothing left to flap over, so quality goes straight back to what the smoothed wait calls for.
+    The smoothed wait also fades with time, so a quiet period after a rush counts as low load even though few
+    requests arrive to show it.
+    """
+
+    __slots__ = "levels", "recover_after", "wait_smoothing", "wait_half_life", "current", "_wait", "_observed", "_calm"
+
+    def __init__(self, levels: tuple[QualityLevel, ...] = default_levels, recover_after: int = 3, wait_smoothing: float = 0.3, wait_half_life: float = 30.0) -> None:
+        """
+        levels: From full quality to the most degraded, with rising thresholds. The first level should have no thresholds.
+        recover_after: Requests in a row at lower load before quality goes back up a level.
+        wait_smoothing: Weight of the newest queue wait in the smoothed average.
+        wait_half_life: Seconds for the smoothed wait to halve while no requests are served.
+        """
+
+        self.levels: tuple[QualityLevel, ...] = levels
+        self.recover_after: int = recover_after
+        self.wait_smoothing: float = wait_smoothing
+        self.wait_half_life: float = wait_half_life
+        self.current: int = 0
+        self._wait: float = 0.0
+        self._observed: float | None = None
+        self._calm: int = 0
+
+        quality_level.set(0)
+
+    def observe_wait(self, seconds: float, now: float | None = None) -> None:
+        now = perf_counter() if now is None else now
+        if self._observed is not None:
+            self._wait *= 0.5 ** (max(now - self._observed, 0.0) / self.wait_half_life)
+        self._observed = now
+
+        self._wait += self.wait_smoothing * (seconds - self._wait)
+        smoothed_wait.set(self._wait)
+
+    def target(self, queue_depth: int) -> int:
+        """
+        The level the current load calls for, ignoring hysteresis.
+        """
+
+        target: int = 0
+        for index, level in enumerate(self.levels):
+            if queue_depth >= level.min_queue_depth or self._wait >= level.min_wait_seconds:
+                target = index
+        return target
+
+    def choose(self, queue_depth: int, wait_seconds: float, now: float | None = None) -> QualityLevel:
+        """
+        Decide the quality of the next request, given how many requests wait behind it and how long it waited itself.
+        """
+
+        self.observe_wait(wait_seconds, now)
+        target: int = self.target(queue_depth)
+
+        if target > self.current:
+            self._calm = 0
+            self._change(target, "lowered", queue_depth)
+        elif target < self.current and queue_depth == 0:
+            self._calm = 0
+            self._change(target, "restored", queue_depth)
+        elif target < self.current:
+            self._calm += 1
+            if self._calm >= self.recover_after:
+                self._calm = 0
+                self._change(self.current - 1, "restored", queue_depth)
+        else:
+            self._calm = 0
+
+        level: QualityLevel = self.levels[self.current]
+        quality_decisions.inc(level = level.name)
+        return level
+
+    def _change(self, index: int, direction: str, queue_depth: int) -> None:
+        logger.info(
+            "Changed quality level.",
+            extra = {"from": self.levels[self.current].name, "to": self.levels[index].name, "queue_depth": queue_depth, "smoothed_wait": round(self._wait, 3)}
+        )
+        self.current = index
+        quality_changes.inc(direction = direction)
+        quality_level.set(index)
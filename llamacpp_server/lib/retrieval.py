@@ -0,0 +1,168 @@
+from typing import Hashable, Protocol, Self
+
+from .models import LLM
+from .metrics import registry
+
+__all__ = "Retriever", "BM25Retriever", "DatabaseRetriever", "CachedRetriever", "fit_context"
+
+cache_lookups = registry.counter(
+    "studassbot_retrieval_cache_lookups",
+    "Retrieval cache lookups, by whether the passages were already cached.",
+    ("result",)
+)
+cache_entries = registry.gauge(
+    "studassbot_retrieval_cache_entries",
+    "Questions with cached retrieval results."
+)
+
+class Retriever(Protocol):
+    """
+    Anything that can find course material relevant to a student's question.
+    retrieve is called from a worker thread, so it may block.
+    version must change whenever the documents searched change.
+    cache_key must be equal for two questions only if retrieve always returns the same passages for them.
+    """
+
+    @property
+    def version(self) -> Hashable:
+        ...
+
+    def cache_key(self, text: str) -> Hashable:
+        ...
+
+    def retrieve(self, text: str) -> list[str]:
+        ...
+
+class BM25Retriever:
+    """
+    Keyword retrieval over an in-memory Haystack document store.
+    Haystack is only imported when one of these is created, so the server doesn't need it unless retrieval is on.
+    """
+
+    __slots__ = "document_store", "retriever", "top_k"
+
+    def __init__(self, documents: dict[str, str], top_k: int = 3) -> None:
+        """
+        documents: Document text keyed on an id, like the output of parsing.parse_directory.
+        top_k: How many documents to retrieve per question.
+        """
+
+        from haystack.dataclasses import Document
+        from haystack.document_stores.in_memory import InMemoryDocumentStore
+        from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
+
+        self.document_store = InMemoryDocumentStore()
+        self.document_store.write_documents([Document(id = document_id, content = text) for document_id, text in documents.items()])
+        self.retriever = InMemoryBM25Retriever(self.document_store)
+        self.top_k: int = top_k
+
+    @classmethod
+    def from_directory(cls, directory_path: str, top_k: int = 3) -> Self:
+        from parsing import parse_directory
+
+        return cls(parse_directory(directory_path), top_k)
+
+    @property
+    def version(self) -> Hashable:
+        # The documents are only written once, when the retriever is created.
+        return 0
+
+    def cache_key(self, text: str) -> Hashable:
+        from haystack_server.lib.cache import bag_of_words
+
+        return bag_of_words(text)
+
+    def rank(self, text: str) -> list[str]:
+        """
+        Ids of the top_k documents, best first.
+        """
+
+        return [document.id for document in self.retriever.run(query = text, top_k = self.top_k)["documents"]]
+
+    def retrieve(self, text: str) -> list[str]:
+        return [document.content for document in self.retriever.run(query = text, top_k = self.top_k)["documents"]]
+
+class DatabaseRetriever:
+    """
+    Keyword links from the haystack_server Database index for one subject.
+    """
+
+    __slots__ = "database", "subject_name"
+
+    def __init__(self, index_path: str, subject_name: str) -> None:
+        from haystack_server.lib.database import Database
+
+        self.database = Database(index_path)
+        self.subject_name: str = subject_name
+
+    @property
+    def version(self) -> Hashable:
+        self.database.refresh()
+        return self.database.version
+
+    def cache_key(self, text: str) -> Hashable:
+        # Links match case sensitive, whitespace separated words.
+        return frozenset(text.split())
+
+    def retrieve(self, text: str) -> list[str]:
+        return [document.content for document in self.database.fetch_relevant_documents(self.subject_name, text)]
+
+class CachedRetriever:
+    """
+    Remembers the passages retrieved for recent questions, since most students ask about the same few assignments.
+
+    Questions are keyed the way the wrapped retriever reads them, so for BM25 differences in case, punctuation and
+    word order still hit. Keys include the retriever's version, so results stop being hit as soon as the documents
+    change. The least recently used question is evicted when the cache is full.
+    """
+
+    __slots__ = "retriever", "cache"
+
+    def __init__(self, retriever: Retriever, max_entries: int = 1024) -> None:
+        from haystack_server.lib.cache import RetrievalCache
+
+        self.retriever: Retriever = retriever
+        self.cache = RetrievalCache(max_entries)
+
+        cache_entries.set_function(lambda: len(self.cache))
+
+    @property
+    def version(self) -> Hashable:
+        return self.retriever.version
+
+    def cache_key(self, text: str) -> Hashable:
+        return self.retriever.cache_key(text)
+
+    def retrieve(self, text: str) -> list[str]:
+        missed: bool = False
+
+        def compute() -> list[str]:
+            nonlocal missed
+            missed = True
+            return self.retriever.retrieve(text)
+
+        passages: list[str] = self.cache.get_or_compute((self.retriever.version, self.retriever.cache_key(text)), compute)
+        cache_lookups.inc(result = "miss" if missed else "hit")
+        return list(passages)
+
+def fit_context(llm: LLM, passages: list[str], budget_tokens: int) -> str:
+    """
+    Join as many passages as fit in the token budget, most relevant first.
+    The first passage that doesn't fit is cut off at the budget rather than dropped, as long as a useful amount fits.
+    """
+
+    parts: list[str] = []
+    remaining: int = budget_tokens
+
+    for passage in passages:
+        tokens: list[int] = llm.tokenize(passage.encode("utf-8"), add_bos = False)
+        if len(tokens) <= remaining:
+            parts.append(passage)
+            remaining -= len(tokens)
+            continue
+
+        if remaining >= 32:
+            parts.append(llm.detokenize(tokens[:remaining]).decode("utf-8", errors = "ignore"))
+        break
+
+    return "\n\n".join(part.strip() for part in parts)
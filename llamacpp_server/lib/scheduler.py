@@ -0,0 +1,302 @@
+import asyncio, websockets
+from collections import deque
+from dataclasses import dataclass, field
+from threading import Event
+from time import perf_counter
+from typing import Hashable, Iterator
+
+from .tracing import Trace
+
+__all__ = "PendingRequest", "Scheduler", "TokenBucket", "RateLimiter"
+
+# A prompt that has been received and is waiting for, or being handled by, the LLM.
+@dataclass(slots = True, eq = False)
+class PendingRequest:
+    socket: websockets.WebSocketServerProtocol
+    user_id: int
+    text: str
+    trace: Trace
+    deadline: float | None = None
+    # Set from the event loop and checked by the generation thread after every token.
+    cancel_event: Event = field(default_factory = Event)
+    # Passages being retrieved for the prompt while it waits in the queue, if retrieval is on.
+    context: asyncio.Future[list[str]] | None = None
+    # Estimated tokens the LLM will process for the request. Users are charged this when it is scheduled.
+    cost: float = 1.0
+
+    @property
+    def request_id(self) -> str:
+        return self.trace.request_id
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def drop_context(self) -> None:
+        """
+        Stop retrieving for a request that will never be answered. Retrieval that already started still runs to the end.
+        """
+
+        if self.context is not None:
+            self.context.cancel()
+
+    def expired(self, now: float | None = None) -> bool:
+        return self.deadline is not None and (perf_counter() if now is None else now) >= self.deadline
+
+class Scheduler:
+    """
+    Fair-share queue of prompts in front of the LLM.
+
+    Every user has their own first come, first served queue, and users take turns by deficit round robin:
+    each turn a user is credited quantum times their weight in tokens and is served as long as the estimated cost
+    of their next prompt fits in their credit. A student sending many long prompts therefore gets the same share
+    of the LLM's time as everyone else, instead of holding up everyone who arrived after them.
+    Credit isn't banked while a user has nothing queued.
+
+    Knows every request's position so clients can be told where they are in line, sheds requests whose
+    deadline passed before they reached the LLM and drops requests that were cancelled while waiting.
+    Only meant to be used from the event loop thread.
+    """
+
+    __slots__ = "quantum", "weights", "_queues", "_ring", "_deficits", "_in_turn", "_size", "_requests", "_arrival"
+
+    def __init__(self, quantum: float = 512, weights: dict[int, float] | None = None) -> None:
+        """
+        quantum: Tokens credited per turn. Smaller is fairer between long and short prompts, larger takes fewer turns.
+        weights: Share of the LLM per user id, relative to the default of 1.
+        """
+
+        # A user who is never credited can never be served, and picking the next request would loop forever.
+        if not quantum > 0:
+            raise ValueError(f"The quantum must be positive, got {quantum}.")
+        for user_id, weight in (weights or {}).items():
+            if not weight > 0:
+                raise ValueError(f"User weights must be positive, got {weight} for user {user_id}.")
+
+        self.quantum: float = quantum
+        self.weights: dict[int, float] = {} if weights is None else weights
+        self._queues: dict[int, deque[PendingRequest]] = {}
+        # Users with queued requests, in the order they take turns. The first one is the user whose turn it is.
+        self._ring: deque[int] = deque()
+        self._deficits: dict[int, float] = {}
+        # Whether the first user in the ring has already been credited for their current turn.
+        self._in_turn: bool = False
+        self._size: int = 0
+        # Every request that hasn't finished yet, including the one currently generating.
+        self._requests: dict[str, PendingRequest] = {}
+        self._arrival = asyncio.Event()
+
+    def submit(self, request: PendingRequest) -> int:
+        """
+        Queue a request and return its position in line, starting at 1.
+        """
+
+        if request.user_id not in self._queues:
+            self._queues[request.user_id] = deque()
+            self._deficits[request.user_id] = 0.0
+            self._ring.append(request.user_id)
+
+        self._queues[request.user_id].append(request)
+        self._requests[request.request_id] = request
+        self._size += 1
+        self._arrival.set()
+
+        for queued, position in self.positions():
+            if queued is request:
+                return position
+        return self._size
+
+    def get(self, request_id: str) -> PendingRequest | None:
+        return self._requests.get(request_id)
+
+    def _remove(self, request: PendingRequest) -> bool:
+        queue: deque[PendingRequest] | None = self._queues.get(request.user_id)
+        if queue is None:
+            return False
+        try:
+            queue.remove(request)
+        except ValueError:
+            return False
+
+        self._size -= 1
+        if len(queue) == 0:
+            self._drop_user(request.user_id)
+        return True
+
+    def _drop_user(self, user_id: int) -> None:
+        if self._ring[0] == user_id:
+            self._in_turn = False
+        self._ring.remove(user_id)
+        del self._queues[user_id]
+        del self._deficits[user_id]
+
+    def cancel(self, request_id: str) -> PendingRequest | None:
+        """
+        Mark a request as cancelled. A queued request is removed from the queue straight away,
+        a request that is generating stops at its next token.
+        """
+
+        request: PendingRequest | None = self._requests.pop(request_id, None)
+        if request is None:
+            return None
+
+        request.cancel_event.set()
+        # A request the worker has already taken is awaiting its context, and cancelling that would stop the worker.
+        if self._remove(request):
+            request.drop_context()
+        return request
+
+    def cancel_connection(self, socket: websockets.WebSocketServerProtocol) -> list[PendingRequest]:
+        """
+        Cancel everything sent over a connection that has closed, since there is nobody left to reply to.
+        """
+
+        return [
+            self.cancel(request.request_id)
+            for request in list(self._requests.values())
+            if request.socket is socket
+        ]
+
+    def shed_expired(self, now: float | None = None) -> list[PendingRequest]:
+        """
+        Remove and return queued requests whose deadline has passed.
+        """
+
+        now = perf_counter() if now is None else now
+        expired: list[PendingRequest] = [request for queue in self._queues.values() for request in queue if request.expired(now)]
+        for request in expired:
+            self._remove(request)
+            del self._requests[request.request_id]
+            request.drop_context()
+        return expired
+
+    def _step(self, queues: dict[int, deque[PendingRequest]], ring: deque[int], deficits: dict[int, float], in_turn: bool) -> tuple[PendingRequest | None, bool]:
+        """
+        One deficit round robin decision over the given state, which is changed in place.
+        Returns the request to serve next and whether the first user in the ring is still in their turn.
+        """
+
+        while len(ring) > 0:
+            user_id: int = ring[0]
+            queue: deque[PendingRequest] = queues[user_id]
+            if not in_turn:
+                deficits[user_id] += self.quantum * self.weights.get(user_id, 1.0)
+                in_turn = True
+
+            if queue[0].cost <= deficits[user_id]:
+                request: PendingRequest = queue.popleft()
+                deficits[user_id] -= request.cost
+                if len(queue) == 0:
+                    ring.popleft()
+                    del queues[user_id]
+                    del deficits[user_id]
+                    in_turn = False
+                return request, in_turn
+
+            ring.rotate(-1)
+            in_turn = False
+
+        return None, False
+
+    def pop(self) -> PendingRequest | None:
+        request, self._in_turn = self._step(self._queues, self._ring, self._deficits, self._in_turn)
+        if request is not None:
+            self._size -= 1
+        return request
+
+    def done(self, request: PendingRequest) -> None:
+        self._requests.pop(request.request_id, None)
+
+    async def wait(self) -> None:
+        """
+        Wait until there is at least one queued request.
+        """
+
+        while self._size == 0:
+            self._arrival.clear()
+            await self._arrival.wait()
+
+    def positions(self) -> Iterator[tuple[PendingRequest, int]]:
+        """
+        The order requests will be served in if no more arrive, worked out by running the scheduler on a copy of its state.
+        """
+
+        queues: dict[int, deque[PendingRequest]] = {user_id: deque(queue) for user_id, queue in self._queues.items()}
+        ring: deque[int] = deque(self._ring)
+        deficits: dict[int, float] = dict(self._deficits)
+        in_turn: bool = self._in_turn
+
+        for position in range(1, self._size + 1):
+            request, in_turn = self._step(queues, ring, deficits, in_turn)
+            yield request, position
+
+    def __len__(self) -> int:
+        return self._size
+
+class TokenBucket:
+    """
+    Allows rate tokens per second on average, with bursts of up to capacity tokens.
+    """
+
+    __slots__ = "rate", "capacity", "tokens", "updated"
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated: float = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float, now: float) -> float:
+        """
+        Take amount tokens if there are enough and return 0, or return the seconds until there will be enough.
+        Amounts above the capacity are capped at it, so a single large request is never refused forever.
+        """
+
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+class RateLimiter:
+    """
+    A token bucket per user or connection, charged with the estimated token cost of every prompt when it arrives.
+    Buckets that have filled back up are forgotten, since a new bucket starts out full anyway.
+    """
+
+    __slots__ = "rate", "burst", "_buckets"
+
+    def __init__(self, rate: float, burst: float) -> None:
+        """
+        rate: Tokens per second each key may use on average.
+        burst: Tokens a key may use at once after being idle.
+        """
+
+        self.rate: float = rate
+        self.burst: float = burst
+        self._buckets: dict[Hashable, TokenBucket] = {}
+
+    def acquire(self, key: Hashable, amount: float, now: float | None = None) -> float:
+        """
+        Charge key for amount tokens. Returns 0 if allowed, otherwise the seconds to wait before trying again.
+        """
+
+        now = perf_counter() if now is None else now
+        bucket: TokenBucket | None = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= 4096:
+                self.prune(now)
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+
+        return bucket.take(amount, now)
+
+    def prune(self, now: float) -> None:
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._buckets[key]
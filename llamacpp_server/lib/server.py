@@ -1,66 +1,515 @@
-import json, websockets, asyncio
-from typing import Any
-from traceback import format_exc
+import json, websockets, asyncio, logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import perf_counter
+from typing import Any, Literal
 
-from ..lib import LLM
+from ..lib import LLM, StaticResult
+from .metrics import registry, serve_metrics
+from .tracing import Trace
+from .scheduler import PendingRequest, Scheduler, RateLimiter
+from .manager import ModelManager
+from .summarizer import HistoryCompactor, format_turns
+from .retrieval import Retriever, fit_context
+from .conversation_log import ConversationLog
+from .checkpoint import Checkpointer
+from .qos import QualityLevel, QualityPolicy
 
 __all__ = "init_server",
 
+logger: logging.Logger = logging.getLogger(__name__)
+
 template: str = """\
 ###Instruction: You are HIOF StudassBot, a friendly, helpful, and efficient chatbot with the goal of assisting students within the Faculty of Information Technology at Høgskolen i Østfold by providing guidance, resources, and support in programming languages, particularly Java. Your approach is to be friendly, helpful, and efficient in your interactions with students and staff. Your task is to be approachable yet professional, with a touch of enthusiasm for your subject matter. You must listen carefully to the questions or tasks that students and staff have and ask clarifying questions if needed or you will be penalized. You must answer all questions given in a natural, human-like manner. Always ensure that your answer is unbiased and avoids relying on stereotypes, or else you will be penalized. You must provide them with the most relevant and accurate information and resources possible. You are proactive and responsive in your communication and respect their time and preferences. You are adaptable and flexible in your service and learn from their feedback and suggestions. You are respectful and polite in your tone and language. The conversation you are expected to lead is a conversation about programming and code, especially about Java, where you provide information, examples, and tips on how to learn and use Java effectively. You must help students by guiding them in the right direction in regard to all the tasks they are assigned by school. You must always try to explain in simple terms if possible. You must also encourage students to ask questions and seek help when needed and create a comfortable and supportive learning environment. You must give short and concise answers without sacrificing quality of answers. You are only allowed to answer in english or norwegian.
+{context}
 {history}
 ###Question: {question}
 ###Answer: \
 """
 
-async def init_server(host: str, port: int, bytes_limit: int, llm: LLM, **prompt_kwargs) -> None:
+stage_seconds = registry.histogram(
+    "studassbot_stage_seconds",
+    "Time spent per request in each stage of the server.",
+    ("stage",)
+)
+requests_total = registry.counter(
+    "studassbot_requests",
+    "Requests handled by the server.",
+    ("outcome",)
+)
+active_connections = registry.gauge(
+    "studassbot_active_connections",
+    "Websocket connections currently open."
+)
+queue_depth = registry.gauge(
+    "studassbot_queue_depth",
+    "Prompts waiting for the LLM."
+)
+cached_users = registry.gauge(
+    "studassbot_cached_users",
+    "Users with a conversation history in memory."
+)
+cached_turns = registry.gauge(
+    "studassbot_cached_turns",
+    "Question and answer pairs held in memory across all users."
+)
+
+def count_tokens(llm: LLM, text: str) -> int:
+    return len(llm.tokenize(text.encode("utf-8"), add_bos = False))
+
+def build_prompt(llm: LLM, history: list[tuple[str, str]], question: str, summary: str | None = None, context: str = "", reserve_tokens: int = 0) -> str:
+    """
+    Fill in the template with as many of the newest history turns as fit in the context window, counted in tokens.
+    The instruction, the retrieved course material and the question are always kept, and so is the summary of the
+    older conversation unless even that doesn't fit. Course material must already fit its own budget.
+    reserve_tokens leaves room in the window for the answer.
+    """
+
+    context_block: str = "" if len(context) == 0 else f"###Course material: {context}"
+    summary_block: str = "" if summary is None else f"###Conversation so far: {summary}"
+    # One token for the BOS token llama-cpp adds in front of the prompt.
+    budget: int = llm.n_ctx() - reserve_tokens - 1
+
+    fixed_tokens: int = count_tokens(llm, template.format(context = context_block, history = summary_block, question = question))
+    if fixed_tokens > budget and summary is not None:
+        summary_block = ""
+        fixed_tokens = count_tokens(llm, template.format(context = context_block, history = "", question = question))
+
+    if fixed_tokens > budget:
+        # A question longer than the whole window keeps its end, which is usually where the actual question is.
+        question_tokens: list[int] = llm.tokenize(question.encode("utf-8"), add_bos = False)
+        keep: int = max(len(question_tokens) - (fixed_tokens - budget), 0)
+        question = llm.detokenize(question_tokens[len(question_tokens) - keep:]).decode("utf-8", errors = "ignore")
+        return template.format(context = context_block, history = "", question = question)
+
+    # Newest first, so the oldest turns are the ones left out. Each turn also costs the newline joining it to the rest.
+    remaining: int = budget - fixed_tokens
+    turns: list[str] = []
+    for turn in reversed(history):
+        text: str = format_turns([turn])
+        tokens: int = count_tokens(llm, text) + 1
+        if tokens > remaining:
+            break
+        remaining -= tokens
+        turns.append(text)
+
+    return template.format(
+        context = context_block,
+        history = "\n".join(filter(None, (summary_block, *reversed(turns)))),
+        question = question
+    )
+
+async def notify(request: PendingRequest, message_type: str, **fields: Any) -> bool:
+    """
+    Send a status message about a request to the client that sent it.
+    Returns False if the connection is already gone.
+    """
+
+    try:
+        await request.socket.send(json.dumps({"type": message_type, "id": request.user_id, "request_id": request.request_id} | fields))
+        return True
+    except websockets.ConnectionClosed:
+        return False
+
+async def send_package(socket: websockets.WebSocketServerProtocol, package: dict[str, Any]) -> bool:
+    try:
+        await socket.send(json.dumps(package))
+        return True
+    except websockets.ConnectionClosed:
+        return False
+
+async def init_server(
+    host: str,
+    port: int,
+    bytes_limit: int,
+    models: ModelManager,
+    metrics_host: str = "localhost",
+    metrics_port: int | None = None,
+    request_timeout: float | None = None,
+    admin_token: str | None = None,
+    compactor: HistoryCompactor | None = None,
+    retriever: Retriever | None = None,
+    context_tokens: int = 256,
+    retrieval_workers: int = 2,
+    conversation_log: ConversationLog | None = None,
+    quality: QualityPolicy | None = None,
+    fallback_models: ModelManager | None = None,
+    fair_share_quantum: float = 512,
+    user_weights: dict[int, float] | None = None,
+    rate_limit: RateLimiter | None = None,
+    rate_limit_per: Literal["user", "connection"] = "user",
+    checkpoint_interval: float | None = 300,
+    restore_max_age: float = 12 * 3600,
+    position_interval: float = 1.0,
+    **prompt_kwargs
+) -> None:
+    """
+    Serve prompts with whatever model the manager holds. The server starts accepting connections straight away
+    and keeps prompts queued until the manager has a model ready.
+
+    request_timeout: Seconds a prompt may wait in the queue before it is dropped, unless the client sends its own timeout.
+    admin_token: Secret that admin messages, like loading a new model, must carry. Admin messages are refused if None.
+    compactor: Summarizes the older part of long conversations while the server is idle. Histories are sent whole if None.
+    retriever: Finds course material for each prompt. Retrieval starts when the prompt arrives and runs on its own
+        threads while the prompt waits in the queue, so it usually costs nothing by the time the LLM is free.
+    context_tokens: The most tokens of retrieved material to put in a prompt.
+    retrieval_workers: Threads retrieving at once.
+    conversation_log: Where every question and answer is stored. Nothing is stored if None.
+    quality: Shortens answers and history as the queue grows. Every request gets full quality if None.
+    fallback_models: A smaller model for the quality levels that ask for it, used whenever it is loaded.
+    fair_share_quantum: Tokens each user with queued prompts is credited per turn. See Scheduler.
+    user_weights: Share of the LLM per user id, relative to the default of 1.
+    rate_limit: Refuses prompts from users, or connections, that spend their token budget faster than it refills.
+        The Discord bot sends everyone's prompts over one connection, so limit per user behind it.
+    rate_limit_per: Whether the rate limit applies per user id or per websocket connection.
+    checkpoint_interval: Seconds between checkpoints of the conversation histories in the conversation log, which
+        are restored when the server starts. Nothing is checkpointed or restored if None or without a conversation log.
+    restore_max_age: Seconds after their last message that a conversation is no longer restored.
+    position_interval: Least seconds between updates of queued requests' positions. Each update only goes to the
+        requests whose position changed since they were last told.
+    """
 
     cache: dict[int, list[tuple[str, str]]] = {}
+    scheduler = Scheduler(fair_share_quantum, user_weights)
+    # Running average of generated tokens per reply, used to estimate the cost of prompts before they run.
+    average_completion_tokens: float = prompt_kwargs.get("max_tokens", 512) / 2
+    # Keeps references to fire and forget tasks so they aren't garbage collected while running.
+    background_tasks: set[asyncio.Task] = set()
+    # Separate from the default executor so retrieval never waits behind a generation thread, or the other way round.
+    retrieval_executor: ThreadPoolExecutor | None = None if retriever is None else ThreadPoolExecutor(retrieval_workers, thread_name_prefix = "retrieval")
+    # One thread for every write to the conversation log, so commits don't block the event loop and stay in order.
+    log_executor: ThreadPoolExecutor | None = None if conversation_log is None else ThreadPoolExecutor(1, thread_name_prefix = "conversation_log")
+    # The position each queued request was last told, by request id.
+    sent_positions: dict[str, int] = {}
+    positions_task: asyncio.Task | None = None
+    positions_sent_at: float = 0.0
+
+    queue_depth.set_function(lambda: len(scheduler))
+    cached_users.set_function(lambda: len(cache))
+    cached_turns.set_function(lambda: sum(map(len, cache.values())))
+
+    checkpointer: Checkpointer | None = None
+    if conversation_log is not None and checkpoint_interval is not None:
+        checkpointer = Checkpointer(conversation_log, cache, compactor, restore_max_age)
+        checkpointer.restore()
+
+    def retrieve(text: str) -> tuple[list[str], float, float]:
+        start: float = perf_counter()
+        passages: list[str] = retriever.retrieve(text)
+        return passages, start, perf_counter()
+
+    async def await_context(request: PendingRequest, llm: LLM) -> str:
+        """
+        Collect the passages retrieved while the request was queued. Only the time spent waiting here adds to the
+        request's latency, so only that goes in the trace, as retrieval_wait. The retrieval itself overlaps the queue
+        wait, and would be counted twice by anything adding up the spans, so its duration only goes to the metrics.
+        """
 
-    async def handler(socket: websockets.WebSocketClientProtocol):
-        async for message in socket:
+        if request.context is None:
+            return ""
+
+        with request.trace.span("retrieval_wait"):
             try:
-                package: dict[str, Any] = json.loads(message)
-
-                if package["id"] not in cache.keys():
-                    cache[package["id"]] = []
-                
-                prompt: str = template.format(
-                    history = "",
-                    question = package["text"]
+                passages, start, end = await request.context
+            except Exception:
+                logger.exception("Failed to retrieve course material, answering without it.", extra = {"user_id": request.user_id, "request_id": request.request_id})
+                return ""
+
+        stage_seconds.observe(end - start, stage = "retrieval")
+        return fit_context(llm, passages, context_tokens)
+
+    def estimate_cost(user_id: int, text: str) -> float:
+        """
+        Tokens the LLM will likely process for a prompt: the question and the history it is sent with, at about four
+        characters per token, plus a typical answer. The prompt can't be longer than the context window, however long
+        the conversation in memory is, so the estimate is capped at n_ctx plus max_tokens.
+        """
+
+        window: int = models.context_window
+        characters: int = len(text)
+        # Newest first like build_prompt, stopping once the window is full.
+        for question, answer in reversed(cache.get(user_id, ())):
+            if characters >= window * 4:
+                break
+            characters += len(question) + len(answer)
+
+        return min(characters / 4, window) + min(average_completion_tokens, prompt_kwargs.get("max_tokens", window))
+
+    async def process(request: PendingRequest, llm: LLM, level: QualityLevel | None = None) -> None:
+        nonlocal average_completion_tokens
+
+        trace: Trace = request.trace
+        log_fields: dict[str, Any] = {"user_id": request.user_id, "request_id": trace.request_id}
+        if level is not None:
+            log_fields["quality"] = level.name
+
+        trace.record("queue_wait", trace.origin, perf_counter())
+
+        context: str = await await_context(request, llm)
+
+        generation_kwargs: dict[str, Any] = prompt_kwargs
+        if level is not None and level.max_tokens is not None:
+            generation_kwargs = prompt_kwargs | {"max_tokens": min(level.max_tokens, prompt_kwargs.get("max_tokens", level.max_tokens))}
+
+        with trace.span("prompt_build"):
+            if request.user_id not in cache.keys():
+                cache[request.user_id] = []
+
+            summary: str | None = None
+            history: list[tuple[str, str]] = cache[request.user_id]
+            if compactor is not None:
+                summary, history = compactor.split(request.user_id, history)
+
+            if level is not None and level.history_turns is not None:
+                history = history[max(len(history) - level.history_turns, 0):]
+                if level.history_turns == 0:
+                    summary = None
+
+            # llama-cpp shortens answers that don't fit in the window, so only part of max_tokens has to be kept free.
+            reserve_tokens: int = min(generation_kwargs.get("max_tokens", 256), llm.n_ctx() // 4)
+            prompt: str = build_prompt(llm, history, request.text, summary, context, reserve_tokens)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(prompt, extra = log_fields)
+
+        logger.info("Generating a reply.", extra = log_fields)
+
+        # Generate in a thread so the event loop keeps accepting prompts and serving metrics meanwhile.
+        generation_start: float = perf_counter()
+        result: StaticResult = await asyncio.to_thread(llm, prompt, cancel_event = request.cancel_event, **generation_kwargs)
+
+        # TODO: Breaks if stream result
+
+        trace.record("prefill", generation_start, generation_start + result.prefill_time)
+        trace.record("decode", generation_start + result.prefill_time, generation_start + result.generation_time)
+
+        average_completion_tokens += 0.1 * (result.response_token_count - average_completion_tokens)
+
+        if request.cancelled:
+            for span in trace.spans:
+                stage_seconds.observe(span.duration, stage = span.name)
+            logger.info("Stopped generating for a cancelled request.", extra = log_fields | {"completion_tokens": result.response_token_count})
+            return
+
+        if len(result.response_text) == 0:
+            logger.warning("Generated empty response.", extra = log_fields)
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug(result.response_text, extra = log_fields)
+
+        with trace.span("store"):
+            # Logged before it is cached, so a checkpoint never holds a turn newer than the message id it is saved with.
+            message_id: int | None = None
+            if conversation_log is not None:
+                message_id = await asyncio.get_running_loop().run_in_executor(
+                    log_executor, conversation_log.append, request.user_id, request.text, result.response_text, trace.request_id
                 )
-                
-                for i in range(len(cache[package["id"]])):
-                    temp_prompt: str = template.format(
-                        history = "\n".join(f"###Question: {question}\n###Answer: {answer}" for question, answer in cache[package["id"]][:i+1]),
-                        question = package["text"]
-                    )
-                    if len(temp_prompt) >= llm.n_ctx():
-                        break
-                        
-                    prompt = temp_prompt
-
-                print(prompt)
-
-                print("Generating a reply.")
-                result = llm(prompt[len(prompt) - llm.n_ctx():], **prompt_kwargs)
-
-                # TODO: Breaks if stream result
-                
-                print("Generated empty response." if len(result.response_text) == 0 else result.response_text)
-
-                cache[package["id"]].append((package["text"], result.response_text))
-                with open("messages.csv", "a+") as file:
-                    file.write(f"{package['id']}¤¤¤{package['text']}¤¤¤{result.response_text}§§§")
-
-                print("Sending reply.")
-
-                await socket.send(json.dumps({"id": package["id"], "text": result.response_text}))
-                print("Finished processing a prompt.")
+            cache[request.user_id].append((request.text, result.response_text))
+            if compactor is not None:
+                compactor.mark(request.user_id)
+            if checkpointer is not None:
+                checkpointer.touch(request.user_id, message_id = message_id)
+
+        # The send span can't be part of the reply itself, so it only ends up in the metrics.
+        with trace.span("send"):
+            await request.socket.send(json.dumps({
+                "type": "reply",
+                "id": request.user_id,
+                "request_id": trace.request_id,
+                "text": result.response_text,
+                "spans": trace.to_json()
+            } | ({} if level is None else {"quality": level.name})))
+
+        for span in trace.spans:
+            stage_seconds.observe(span.duration, stage = span.name)
+
+        requests_total.inc(outcome = "ok")
+        logger.info(
+            "Finished processing a prompt.",
+            extra = log_fields | {
+                "prompt_tokens": result.prompt_token_count,
+                "completion_tokens": result.response_token_count,
+                "finish_reason": result.finish_reason,
+                "draft_acceptance": result.acceptance_rate,
+                "total_seconds": round(trace.elapsed(), 3)
+            }
+        )
+
+    async def send_positions(delay: float) -> None:
+        nonlocal positions_sent_at
+
+        await asyncio.sleep(delay)
+        positions_sent_at = perf_counter()
+        changed: list[tuple[PendingRequest, int]] = []
+        positions: dict[str, int] = {}
+        for request, position in scheduler.positions():
+            positions[request.request_id] = position
+            if sent_positions.get(request.request_id) != position:
+                changed.append((request, position))
+        # Also forgets the requests that have left the queue.
+        sent_positions.clear()
+        sent_positions.update(positions)
+
+        await asyncio.gather(*(notify(request, "queued", position = position) for request, position in changed))
+
+    def notify_positions() -> None:
+        """
+        Tell queued requests their new positions, at most once per position_interval. Calls in between are
+        covered by the update already waiting, which reads the positions when it runs.
+        """
+
+        nonlocal positions_task
+        if positions_task is not None and not positions_task.done():
+            return
+        delay: float = max(positions_sent_at + position_interval - perf_counter(), 0.0)
+        positions_task = asyncio.create_task(send_positions(delay))
+
+    async def compact(user_id: int) -> None:
+        """
+        Summarize one user's history in the background. Live prompts come first, so the summary is abandoned
+        at the next token if a prompt arrives meanwhile.
+        """
+
+        preempt = Event()
+        arrival: asyncio.Task = asyncio.create_task(scheduler.wait())
+        arrival.add_done_callback(lambda task: task.cancelled() or preempt.set())
+        try:
+            with models.acquire() as llm:
+                await asyncio.to_thread(compactor.compact, llm, user_id, list(cache.get(user_id, ())), preempt)
+        except Exception:
+            logger.exception("Encountered an error while summarizing a conversation.", extra = {"user_id": user_id})
+        finally:
+            arrival.cancel()
+
+        if preempt.is_set():
+            compactor.mark(user_id)
+
+    async def write_checkpoints() -> None:
+        while True:
+            await asyncio.sleep(checkpoint_interval)
+            try:
+                # The snapshot is taken here, where turns are added to the cache, and written on the log's thread.
+                snapshot: tuple[int, dict] | None = checkpointer.snapshot()
+                if snapshot is not None:
+                    await asyncio.get_running_loop().run_in_executor(log_executor, checkpointer.save, *snapshot)
             except Exception:
-                print("Encountered an error while listening for prompts.")
-                print(format_exc())
+                logger.exception("Encountered an error while writing a checkpoint.")
+
+    async def worker() -> None:
+        while True:
+            if compactor is not None and len(scheduler) == 0 and models.ready:
+                user_id: int | None = compactor.next_job()
+                if user_id is not None:
+                    await compact(user_id)
+                    continue
+
+            await scheduler.wait()
+            await models.wait_ready()
+
+            for expired in scheduler.shed_expired():
+                requests_total.inc(outcome = "expired")
+                logger.info("Dropped a prompt that waited past its deadline.", extra = {"user_id": expired.user_id, "request_id": expired.request_id})
+                await notify(expired, "expired")
+
+            request: PendingRequest | None = scheduler.pop()
+            if request is None:
+                continue
+
+            level: QualityLevel | None = None
+            if quality is not None:
+                level = quality.choose(len(scheduler), perf_counter() - request.trace.origin)
+            manager: ModelManager = models
+            if level is not None and level.use_fallback and fallback_models is not None and fallback_models.ready:
+                manager = fallback_models
+
+            await notify(request, "started")
+            notify_positions()
+
+            try:
+                with manager.acquire() as llm:
+                    await process(request, llm, level)
+            except Exception:
+                requests_total.inc(outcome = "error")
+                logger.exception("Encountered an error while processing a prompt.")
+            finally:
+                scheduler.done(request)
+
+    async def load_model(socket: websockets.WebSocketServerProtocol, model_path: str) -> None:
+        try:
+            seconds: float = await models.load(model_path)
+            await send_package(socket, {"type": "model_loaded", "model_path": model_path, "seconds": round(seconds, 3)})
+        except Exception as exception:
+            logger.exception("Failed to load model.", extra = {"model_path": model_path})
+            await send_package(socket, {"type": "model_load_failed", "model_path": model_path, "error": str(exception)})
+
+    async def receive(socket: websockets.WebSocketServerProtocol, package: dict[str, Any], received: float) -> None:
+        match package.get("type", "prompt"):
+            case "prompt":
+                timeout: float | None = package.get("timeout", request_timeout)
+                request = PendingRequest(
+                    socket,
+                    package["id"],
+                    package["text"],
+                    Trace(package.get("request_id"), received),
+                    None if timeout is None else received + timeout,
+                    cost = estimate_cost(package["id"], package["text"])
+                )
+                if rate_limit is not None:
+                    retry_after: float = rate_limit.acquire(request.user_id if rate_limit_per == "user" else id(socket), request.cost, received)
+                    if retry_after > 0:
+                        requests_total.inc(outcome = "rate_limited")
+                        logger.info("Refused a prompt over the rate limit.", extra = {"user_id": request.user_id, "request_id": request.request_id, "retry_after": round(retry_after, 1)})
+                        await notify(request, "rate_limited", retry_after = round(retry_after, 1))
+                        return
+                if retriever is not None:
+                    request.context = asyncio.get_running_loop().run_in_executor(retrieval_executor, retrieve, request.text)
+                position: int = scheduler.submit(request)
+                sent_positions[request.request_id] = position
+                await notify(request, "queued", position = position, ready = models.ready)
+                # A prompt from a user with nothing queued can be served before prompts already waiting, moving them back.
+                notify_positions()
+            case "cancel":
+                cancelled: PendingRequest | None = scheduler.cancel(package["request_id"])
+                if cancelled is not None:
+                    logger.info("Request was cancelled by the client.", extra = {"user_id": cancelled.user_id, "request_id": cancelled.request_id})
+                    requests_total.inc(outcome = "cancelled")
+            case "status":
+                await send_package(socket, {"type": "status", "queue_depth": len(scheduler)} | models.status())
+            case "load_model":
+                if admin_token is None or package.get("admin_token") != admin_token:
+                    logger.warning("Refused an admin message with a wrong token.")
+                    await send_package(socket, {"type": "model_load_failed", "model_path": package.get("model_path"), "error": "Not authorized."})
+                elif models.loading is not None:
+                    await send_package(socket, {"type": "model_load_failed", "model_path": package["model_path"], "error": f"Already loading {models.loading}."})
+                else:
+                    background_tasks.add(task := asyncio.create_task(load_model(socket, package["model_path"])))
+                    task.add_done_callback(background_tasks.discard)
+                    await send_package(socket, {"type": "status", "queue_depth": len(scheduler)} | models.status())
+            case unknown:
+                raise ValueError(f"Unknown message type {unknown}.")
+
+    async def handler(socket: websockets.WebSocketServerProtocol):
+        active_connections.inc()
+        try:
+            async for message in socket:
+                try:
+                    await receive(socket, json.loads(message), perf_counter())
+                except Exception:
+                    requests_total.inc(outcome = "invalid")
+                    logger.exception("Encountered an error while listening for prompts.")
+        finally:
+            active_connections.dec()
+            for request in scheduler.cancel_connection(socket):
+                logger.info("Request was cancelled because its connection closed.", extra = {"user_id": request.user_id, "request_id": request.request_id})
+                requests_total.inc(outcome = "cancelled")
+
+    if metrics_port is not None:
+        await serve_metrics(metrics_host, metrics_port)
+        logger.info("Serving metrics.", extra = {"host": metrics_host, "port": metrics_port})
 
+    worker_task: asyncio.Task = asyncio.create_task(worker())
+    if checkpointer is not None:
+        checkpoint_task: asyncio.Task = asyncio.create_task(write_checkpoints())
+        background_tasks.add(checkpoint_task)
 
     async with websockets.serve(
         handler,
@@ -69,6 +518,14 @@ async def init_server(host: str, port: int, bytes_limit: int, llm: LLM, **prompt
         read_limit = bytes_limit,
         write_limit = bytes_limit,
         ping_timeout = None
-            ) as sock:
-        print(f"Connection with {sock} established.")
-        await asyncio.Future()
+            ):
+        logger.info("Server started.", extra = {"host": host, "port": port})
+        try:
+            await worker_task
+        finally:
+            # Let the log thread finish its writes, then save the newest turns, so a planned restart loses nothing.
+            if log_executor is not None:
+                log_executor.shutdown(wait = True)
+            if checkpointer is not None:
+                checkpoint_task.cancel()
+                checkpointer.write()
@@ -0,0 +1,151 @@
+import logging
+from dataclasses import dataclass
+from threading import Event
+
+from .models import LLM, StaticResult
+from .metrics import registry
+
+__all__ = "ConversationSummary", "HistoryCompactor"
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+summary_template: str = """\
+###Instruction: Summarize the conversation between a student and HIOF StudassBot below in a few sentences. Keep what the student is trying to achieve, the names of classes, methods and errors that were mentioned, and the advice that was given.
+{previous}
+{turns}
+###Summary: \
+"""
+
+compactions_total = registry.counter(
+    "studassbot_compactions",
+    "Conversation summaries generated in idle time.",
+    ("outcome",)
+)
+compaction_seconds = registry.histogram(
+    "studassbot_compaction_seconds",
+    "Time spent generating a conversation summary."
+)
+
+# A summary that stands in for the first covered_turns question and answer pairs of a user's history.
+@dataclass(slots = True)
+class ConversationSummary:
+    text: str
+    covered_turns: int
+
+def format_turns(turns: list[tuple[str, str]]) -> str:
+    return "\n".join(f"###Question: {question}\n###Answer: {answer}" for question, answer in turns)
+
+class HistoryCompactor:
+    """
+    Keeps prompts short by summarizing the older part of long conversations.
+
+    When the turns of a user's history that aren't summarized yet exceed threshold_tokens, everything except the
+    newest keep_turns turns is folded into a short summary by the same LLM. The server only does this while no
+    prompts are waiting, and aborts it as soon as one arrives.
+    """
+
+    __slots__ = "threshold_tokens", "keep_turns", "max_tokens", "summaries", "_dirty"
+
+    def __init__(self, threshold_tokens: int = 384, keep_turns: int = 2, max_tokens: int = 128) -> None:
+        """
+        threshold_tokens: How long the unsummarized part of the history may get before it is summarized.
+        keep_turns: The newest turns that are always sent word for word.
+        max_tokens: The longest summary to generate.
+        """
+
+        self.threshold_tokens: int = threshold_tokens
+        self.keep_turns: int = keep_turns
+        self.max_tokens: int = max_tokens
+        self.summaries: dict[int, ConversationSummary] = {}
+        # Users whose history grew since it was last checked. Dicts keep insertion order, so the oldest goes first.
+        self._dirty: dict[int, None] = {}
+
+    def mark(self, user_id: int) -> None:
+        self._dirty[user_id] = None
+
+    def next_job(self) -> int | None:
+        if len(self._dirty) == 0:
+            return None
+        user_id: int = next(iter(self._dirty))
+        del self._dirty[user_id]
+        return user_id
+
+    def split(self, user_id: int, history: list[tuple[str, str]]) -> tuple[str | None, list[tuple[str, str]]]:
+        """
+        The summary to use for a history, if any, and the turns that come after it.
+        """
+
+        summary: ConversationSummary | None = self.summaries.get(user_id)
+        if summary is None or summary.covered_turns > len(history):
+            return None, history
+        return summary.text, history[summary.covered_turns:]
+
+    def fit_turns(self, llm: LLM, previous: str | None, turns: list[tuple[str, str]]) -> list[tuple[str, str]]:
+        """
+        The oldest turns that fit in the context window next to the instruction, the previous summary and the
+        summary to be generated, counted in tokens. A single turn too long to fit is cut off at the end instead.
+        """
+
+        empty_prompt: str = summary_template.format(previous = "" if previous is None else f"###Summary so far: {previous}", turns = "")
+        # One token for the BOS token llama-cpp adds in front of the prompt.
+        remaining: int = llm.n_ctx() - self.max_tokens - 1 - len(llm.tokenize(empty_prompt.encode("utf-8"), add_bos = False))
+
+        fitting: list[tuple[str, str]] = []
+        for turn in turns:
+            # Each turn also costs the newline joining it to the rest.
+            tokens: int = len(llm.tokenize(format_turns([turn]).encode("utf-8"), add_bos = False)) + 1
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            fitting.append(turn)
+
+        if len(fitting) == 0 and len(turns) > 0:
+            question, answer = turns[0]
+            overhead: int = len(llm.tokenize(format_turns([("", "")]).encode("utf-8"), add_bos = False)) + 1
+            room: int = max(remaining - overhead, 0)
+            question_tokens: list[int] = llm.tokenize(question.encode("utf-8"), add_bos = False)
+            answer_tokens: list[int] = llm.tokenize(answer.encode("utf-8"), add_bos = False)
+            # The question gets at least half the room, and more if the answer doesn't need the rest.
+            question_tokens = question_tokens[:max(room // 2, room - len(answer_tokens))]
+            answer_tokens = answer_tokens[:room - len(question_tokens)]
+            fitting.append((
+                llm.detokenize(question_tokens).decode("utf-8", errors = "ignore"),
+                llm.detokenize(answer_tokens).decode("utf-8", errors = "ignore")
+            ))
+
+        return fitting
+
+    def compact(self, llm: LLM, user_id: int, history: list[tuple[str, str]], cancel_event: Event | None = None) -> ConversationSummary | None:
+        """
+        Summarize the history if it is over the threshold. Blocks while generating, so call it from a thread.
+        Returns None if nothing was summarized, either because it wasn't needed or because cancel_event was set.
+        """
+
+        previous, turns = self.split(user_id, history)
+        if len(turns) <= self.keep_turns:
+            return None
+
+        if len(llm.tokenize(format_turns(turns).encode("utf-8"), add_bos = False)) < self.threshold_tokens:
+            return None
+
+        covered: list[tuple[str, str]] = self.fit_turns(llm, previous, turns[:len(turns) - self.keep_turns])
+        prompt: str = summary_template.format(
+            previous = "" if previous is None else f"###Summary so far: {previous}",
+            turns = format_turns(covered)
+        )
+
+        result: StaticResult = llm(prompt, cancel_event = cancel_event, max_tokens = self.max_tokens, temperature = 0.2)
+        compaction_seconds.observe(result.generation_time)
+
+        if result.finish_reason == "cancelled":
+            compactions_total.inc(outcome = "preempted")
+            return None
+
+        summary = ConversationSummary(result.response_text.strip(), len(history) - len(turns) + len(covered))
+        self.summaries[user_id] = summary
+        if len(covered) < len(turns) - self.keep_turns:
+            # Only the oldest turns fit in one summary, so the rest are folded in by the next round.
+            self.mark(user_id)
+        compactions_total.inc(outcome = "ok")
+        logger.info("Summarized conversation.", extra = {"user_id": user_id, "covered_turns": summary.covered_turns, "summary_tokens": result.response_token_count})
+        return summary
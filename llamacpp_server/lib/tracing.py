@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any, Iterator
+from uuid import uuid4
+
+__all__ = "Span", "Trace"
+
+@dataclass(slots = True)
+class Span:
+    name: str
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+class Trace:
+    """
+    Timestamped spans for one request as it passes through the server.
+    Span times are stored as perf_counter values and reported relative to when the request was received,
+    because the client's clock can't be compared to ours.
+    """
+
+    __slots__ = "request_id", "origin", "spans"
+
+    def __init__(self, request_id: str | None = None, origin: float | None = None) -> None:
+        self.request_id: str = uuid4().hex if request_id is None else request_id
+        self.origin: float = perf_counter() if origin is None else origin
+        self.spans: list[Span] = []
+
+    def record(self, name: str, start: float, end: float) -> Span:
+        span = Span(name, start, end)
+        self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start: float = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, perf_counter())
+
+    def elapsed(self) -> float:
+        return perf_counter() - self.origin
+
+    def to_json(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "name": span.name,
+                "start": round(span.start - self.origin, 6),
+                "duration": round(span.duration, 6)
+            }
+            for span in self.spans
+        ]
@@ -0,0 +1,32 @@
+import json, os, tomllib
+from typing import Any
+
+__all__ = "load_runtime_config", "write_runtime_config"
+
+def load_runtime_config(file_path: str = "runtime.toml") -> dict[str, Any]:
+    """
+    Llama runtime parameters, like n_threads and n_batch, from the [llama] table of a config file written by the
+    autotuner. Returns an empty dict if the file doesn't exist, so the caller's defaults apply.
+    """
+
+    if not os.path.exists(file_path):
+        return {}
+
+    with open(file_path, "rb") as file:
+        return tomllib.load(file).get("llama", {})
+
+def format_value(value: bool | int | float | str) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    # JSON strings are valid TOML basic strings.
+    return json.dumps(value)
+
+def write_runtime_config(file_path: str, parameters: dict[str, bool | int | float | str], comments: list[str] | None = None) -> None:
+    lines: list[str] = [f"# {comment}" for comment in comments or ()]
+    lines.append("[llama]")
+    lines.extend(f"{name} = {format_value(value)}" for name, value in parameters.items())
+
+    with open(file_path, "w", encoding = "utf-8") as file:
+        file.write("\n".join(lines) + "\n")
@@ -0,0 +1,89 @@
+# A copy of discord_interface/startup.py. The bot runs as `python discord_interface`, which puts only its own
+# directory on sys.path, so it can't import this one. Keep the two the same.
+
+import builtins, sys
+from contextlib import contextmanager
+from importlib.util import resolve_name
+from threading import local
+from time import perf_counter
+from typing import Any, Iterator, TextIO
+
+__all__ = "StartupProfiler",
+
+class StartupProfiler:
+    """
+    Times the phases of starting a server and every module imported on the way, for --profile-startup.
+
+    Imports are timed by wrapping __import__ from the moment the profiler is created. A module's total time includes
+    the modules it imports itself, its own time leaves them out, which points at the module that is actually slow.
+    Does nothing when created disabled, so entry points can use it unconditionally.
+    """
+
+    __slots__ = "enabled", "start", "phases", "imports", "_local", "_original_import"
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled: bool = enabled
+        self.start: float = perf_counter()
+        # Name, start relative to the profiler's creation and duration of every phase.
+        self.phases: list[tuple[str, float, float]] = []
+        # Total and own seconds of every module imported for the first time.
+        self.imports: dict[str, tuple[float, float]] = {}
+        # Per thread stack of the time spent in nested imports, since imports can run in worker threads too.
+        self._local = local()
+        self._original_import = builtins.__import__
+
+        if enabled:
+            builtins.__import__ = self._import
+
+    def _import(self, name: str, globals: dict[str, Any] | None = None, locals: dict[str, Any] | None = None, fromlist: tuple[str, ...] = (), level: int = 0) -> Any:
+        package: str | None = (globals or {}).get("__package__")
+        if level > 0 and not package:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        full_name: str = name if level == 0 else resolve_name("." * level + name, package)
+        if full_name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        stack: list[float] = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        start: float = perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed: float = perf_counter() - start
+            nested: float = stack.pop()
+            if len(stack) > 0:
+                stack[-1] += elapsed
+            self.imports[full_name] = elapsed, elapsed - nested
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start: float = perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.phases.append((name, start - self.start, perf_counter() - start))
+
+    def report(self, file: TextIO | None = None, import_count: int = 25) -> None:
+        """
+        Stop timing imports and print the phases in the order they started, then the slowest imports by their own time.
+        """
+
+        if not self.enabled:
+            return
+        self.enabled = False
+        if builtins.__import__ == self._import:
+            builtins.__import__ = self._original_import
+
+        file = sys.stderr if file is None else file
+        print(f"Startup took {perf_counter() - self.start:.3f} s.", file = file)
+        print("Phases:", file = file)
+        for name, offset, duration in sorted(self.phases, key = lambda phase: phase[1]):
+            print(f"  {name:30} {duration:8.3f} s  (started at {offset:.3f} s)", file = file)
+
+        print(f"Slowest of {len(self.imports)} imports, own / total seconds:", file = file)
+        slowest: list[tuple[str, tuple[float, float]]] = sorted(self.imports.items(), key = lambda item: item[1][1], reverse = True)
+        for name, (total, own) in slowest[:import_count]:
+            print(f"  {name:50} {own:8.3f} / {total:8.3f}", file = file)
+        file.flush()
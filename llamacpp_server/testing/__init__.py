@@ -1,2 +1,3 @@
 from .tester import *
-from .utils import *
\ No newline at end of file
+from .utils import *
+from .sweep import *
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+Finds the llama runtime parameters that answer fastest on this machine and writes them to runtime.toml,
+which both servers read at startup.
+
+Parameters are tuned one at a time, in the order of search_space, keeping the best value of each before moving on
+to the next. That takes a dozen or so model loads where trying every combination would take over a hundred.
+Every configuration runs in its own process through the sweep runner, so an interrupted run resumes where it stopped.
+Edit the settings below and run it from the StudassBot directory:
+    python -m llamacpp_server.testing.autotune
+"""
+
+import os
+from contextlib import closing
+from datetime import datetime
+from typing import Any
+
+from llamacpp_server.lib import ConversationLog, LogRecord, write_runtime_config
+from llamacpp_server.lib.server import template
+from llamacpp_server.testing.sweep import SweepJob, SweepSummary, run_sweep, rank_results, print_ranking
+
+__all__ = "autotune",
+
+llm_path: str = "CHANGE ME"
+output_path: str = "runtime.toml"
+results_path: str = "autotune_results.jsonl"
+
+# Questions are taken from the newest entries of the conversation log if it exists, so the prompts look like real traffic.
+log_path: str = "messages.sqlite3"
+prompt_count: int = 8
+fallback_questions: list[str] = [
+    "How can I create a class in Java that represents a celestial body, and create subclasses that represent things like planets and moons?",
+    "What is the difference between an interface and an abstract class?",
+    "Why do I get a NullPointerException when I call a method on an object in my array?",
+    "How do I read a file line by line in Java?"
+]
+generation_kwargs: dict[str, Any] = {"max_tokens": 128, "temperature": 0.0, "stop": "###"}
+run_count: int = 2
+
+# Where tuning starts. n_gpu_layers is neither tuned nor written, the servers keep their own.
+base_config: dict[str, Any] = {"n_gpu_layers": 0, "n_ctx": 1024, "n_batch": 256, "use_mmap": True, "use_mlock": False}
+
+cpu_count: int = os.cpu_count() or 1
+search_space: dict[str, list[dict[str, Any]]] = {
+    "n_threads": [{"n_threads": n} for n in sorted({max(cpu_count // 4, 1), max(cpu_count // 2, 1), cpu_count})],
+    "n_threads_batch": [{"n_threads_batch": n} for n in sorted({max(cpu_count // 2, 1), cpu_count})],
+    "n_batch": [{"n_batch": n} for n in (128, 256, 512)],
+    # Smaller windows are a little faster but fit less conversation history, so they only win by a clear margin.
+    "n_ctx": [{"n_ctx": n} for n in (1024, 2048)],
+    "memory": [{"use_mmap": True, "use_mlock": False}, {"use_mmap": True, "use_mlock": True}, {"use_mmap": False, "use_mlock": False}]
+}
+
+# Configurations within this fraction of the fastest count as equally fast, and the tie goes to the bigger context
+# window, then to the lower peak memory.
+tolerance: float = 0.03
+time_limit: float | None = 1800
+memory_limit: int | None = None
+
+def representative_prompts() -> list[str]:
+    questions: list[str] = fallback_questions
+    if os.path.exists(log_path):
+        with closing(ConversationLog(log_path)) as log:
+            newest: list[LogRecord] = list(log.iter_newest(prompt_count))
+        if len(newest) > 0:
+            questions = [record.question for record in newest]
+    return [template.format(context = "", history = "", question = question) for question in questions]
+
+def pick(summaries: list[SweepSummary]) -> SweepSummary:
+    fastest: float = min(summary.mean_request_seconds for summary in summaries)
+    near: list[SweepSummary] = [summary for summary in summaries if summary.mean_request_seconds <= fastest * (1 + tolerance)]
+    return min(near, key = lambda summary: (-summary.config.get("n_ctx", 0), summary.peak_rss_bytes, summary.mean_request_seconds))
+
+def autotune() -> dict[str, Any]:
+    prompts: list[str] = representative_prompts()
+    best: dict[str, Any] = dict(base_config)
+    chosen: SweepSummary | None = None
+
+    for name, options in search_space.items():
+        jobs: list[SweepJob] = [SweepJob(llm_path, best | option, prompts, run_count, generation_kwargs) for option in options]
+        run_sweep(jobs, results_path, time_limit, memory_limit)
+
+        keys: set[str] = {job.key for job in jobs}
+        summaries: list[SweepSummary] = [summary for summary in rank_results(results_path) if summary.key in keys]
+        if len(summaries) == 0:
+            print(f"Every {name} option failed, keeping {best}")
+            continue
+
+        chosen = pick(summaries)
+        best = dict(chosen.config)
+        print(f"Best {name}: {chosen.key}")
+
+    print_ranking(rank_results(results_path))
+
+    if chosen is None:
+        raise RuntimeError("No configuration finished, so there is nothing to write.")
+
+    tuned: dict[str, Any] = {name: value for name, value in best.items() if name != "n_gpu_layers"}
+    write_runtime_config(output_path, tuned, [
+        f"Written by python -m llamacpp_server.testing.autotune on {datetime.now():%Y-%m-%d %H:%M} for {os.path.basename(llm_path)}.",
+        f"Prefill {chosen.prefill_tokens_per_second:.1f} tokens/s, decode {chosen.decode_tokens_per_second:.1f} tokens/s, "
+        f"{chosen.mean_request_seconds:.2f} s per prompt, peak RSS {chosen.peak_rss_bytes / 2**30:.2f} GiB."
+    ])
+    print(f"Wrote {output_path}")
+    return tuned
+
+if __name__ == "__main__":
+    autotune()
@@ -0,0 +1,253 @@
+"""
+Answers a file of questions offline with the same prompt template, history handling and course material retrieval
+as the server, for generating FAQs, checking answers after changing the template and evaluating models.
+
+Questions are read from a JSON lines file with one object per line:
+    {"id": "q1", "question": "What is an interface?", "history": [["Earlier question", "Earlier answer"]]}
+Only "question" is required. The id defaults to the line number and the history to none.
+
+Answers are appended to the output file with their timings as soon as each one is done. Questions whose id is
+already in the output file are skipped, so an interrupted run continues where it stopped when run again.
+Run it from the StudassBot directory:
+    python -m llamacpp_server.testing.batch questions.jsonl answers.jsonl --model model.gguf --workers 2
+"""
+
+import argparse, json, os, queue, sys, time, traceback
+import multiprocessing as mp
+from dataclasses import dataclass, field
+from multiprocessing.process import BaseProcess
+from typing import Any, Iterator
+
+from llamacpp_server.testing.sweep import load_results
+
+__all__ = "BatchQuestion", "read_questions", "run_batch"
+
+# One question to answer, with the conversation it is a follow up to.
+@dataclass(slots = True)
+class BatchQuestion:
+    id: str
+    question: str
+    history: list[tuple[str, str]] = field(default_factory = list)
+
+def read_questions(file_path: str) -> Iterator[BatchQuestion]:
+    with open(file_path, "r", encoding = "utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            if line.strip() == "":
+                continue
+            record: dict[str, Any] = json.loads(line)
+            yield BatchQuestion(
+                str(record.get("id", line_number)),
+                record["question"],
+                [(question, answer) for question, answer in record.get("history", ())]
+            )
+
+def answer_worker(worker: int, settings: dict[str, Any], tasks: mp.Queue, results: mp.Queue) -> None:
+    """
+    The body of a worker process. Loads its own model and retriever, then answers chunks of questions from tasks
+    until it gets None, putting one record per question on results. A question that fails gets a record with status
+    "error" and the worker carries on. A None on results means the worker has stopped.
+    """
+
+    try:
+        from llamacpp_server.lib import LLM, StaticResult, Retriever, load_retriever, fit_context
+        from llamacpp_server.lib.server import build_prompt
+
+        llm = LLM(settings["model_path"], verbose = False, **settings["model_kwargs"])
+        retriever: Retriever | None = None
+        if settings["document_directory"] is not None:
+            retriever = load_retriever(settings["document_directory"], settings["embedding_model_path"], settings["embedding_index_path"])
+
+        # Room for the answer, the same as the server leaves.
+        reserve_tokens: int = min(settings["generation_kwargs"].get("max_tokens", 256), llm.n_ctx() // 4)
+
+        while (chunk := tasks.get()) is not None:
+            texts: list[str] = [item.question for item in chunk]
+            retrieval_start: float = time.perf_counter()
+            passages: list[list[str] | None] = [[] for _ in chunk]
+            if retriever is not None:
+                try:
+                    # Dense retrievers embed and search a whole chunk at once.
+                    passages = retriever.retrieve_many(texts) if hasattr(retriever, "retrieve_many") else [retriever.retrieve(text) for text in texts]
+                except Exception:
+                    # Retried one question at a time below, so only the questions that fail get an error record.
+                    passages = [None for _ in chunk]
+            retrieval_seconds: float = (time.perf_counter() - retrieval_start) / len(chunk)
+
+            for item, item_passages in zip(chunk, passages):
+                start: float = time.perf_counter()
+                try:
+                    if item_passages is None:
+                        item_passages = retriever.retrieve(item.question)
+                    context: str = fit_context(llm, item_passages, settings["context_tokens"]) if len(item_passages) > 0 else ""
+                    prompt: str = build_prompt(llm, item.history, item.question, None, context, reserve_tokens)
+                    result: StaticResult = llm(prompt, **settings["generation_kwargs"])
+                except Exception as error:
+                    results.put({
+                        "id": item.id,
+                        "question": item.question,
+                        "status": "error",
+                        "error": f"{type(error).__name__}: {error}",
+                        "worker": worker,
+                        "total_seconds": retrieval_seconds + time.perf_counter() - start
+                    })
+                    continue
+
+                results.put({
+                    "id": item.id,
+                    "question": item.question,
+                    "answer": result.response_text,
+                    "status": "ok",
+                    "worker": worker,
+                    "prompt_tokens": result.prompt_token_count,
+                    "completion_tokens": result.response_token_count,
+                    "finish_reason": result.finish_reason,
+                    "retrieval_seconds": retrieval_seconds,
+                    "prefill_seconds": result.prefill_time,
+                    "decode_seconds": result.decode_time,
+                    "total_seconds": retrieval_seconds + time.perf_counter() - start
+                })
+    except BaseException:
+        print(f"Worker {worker} stopped:\n{traceback.format_exc()}", file = sys.stderr, flush = True)
+    finally:
+        results.put(None)
+
+def run_batch(
+    questions_path: str,
+    output_path: str,
+    model_path: str,
+    workers: int = 1,
+    chunk_size: int = 8,
+    model_kwargs: dict[str, Any] | None = None,
+    generation_kwargs: dict[str, Any] | None = None,
+    document_directory: str | None = None,
+    embedding_model_path: str | None = None,
+    embedding_index_path: str = "embeddings",
+    context_tokens: int = 256
+) -> int:
+    """
+    Answer every question in questions_path that isn't in output_path yet. Returns the number answered.
+
+    llama-cpp answers one prompt at a time per model, so throughput comes from running several worker processes,
+    each with its own model and a share of the CPU threads. Questions are handed out in chunks so retrieval can
+    embed a chunk at once. Every prompt starts with the same instruction, and llama-cpp reuses the part of its KV
+    cache that matches the previous prompt, so the instruction is only evaluated once per worker.
+    Questions that failed are written with status "error" and are tried again on the next run.
+    """
+
+    finished: set[str] = {record["id"] for record in load_results(output_path) if record.get("status") == "ok"}
+    pending: list[BatchQuestion] = [item for item in read_questions(questions_path) if item.id not in finished]
+    print(f"{len(finished)} questions already answered, {len(pending)} to go.")
+    if len(pending) == 0:
+        return 0
+
+    workers = max(min(workers, len(pending)), 1)
+    model_kwargs = {"n_threads": max((os.cpu_count() or 1) // workers, 1)} | (model_kwargs or {})
+    settings: dict[str, Any] = {
+        "model_path": model_path,
+        "model_kwargs": model_kwargs,
+        "generation_kwargs": generation_kwargs or {},
+        "document_directory": document_directory,
+        "embedding_model_path": embedding_model_path,
+        "embedding_index_path": embedding_index_path,
+        "context_tokens": context_tokens
+    }
+
+    # Spawned rather than forked, so each worker loads its own model into a clean process.
+    context = mp.get_context("spawn")
+    tasks: mp.Queue = context.Queue()
+    results: mp.Queue = context.Queue()
+    for offset in range(0, len(pending), chunk_size):
+        tasks.put(pending[offset:offset + chunk_size])
+    for _ in range(workers):
+        tasks.put(None)
+
+    processes: list[BaseProcess] = [
+        context.Process(target = answer_worker, args = (worker, settings, tasks, results), daemon = True)
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    start: float = time.perf_counter()
+    answered: int = 0
+    failed: int = 0
+    completion_tokens: int = 0
+    running: int = workers
+    try:
+        with open(output_path, "a", encoding = "utf-8") as file:
+            while running > 0:
+                try:
+                    record: dict[str, Any] | None = results.get(timeout = 1)
+                except queue.Empty:
+                    # A worker killed by the OS never gets to say it stopped.
+                    running = min(running, sum(process.is_alive() for process in processes))
+                    continue
+
+                if record is None:
+                    running -= 1
+                    continue
+
+                file.write(json.dumps(record, ensure_ascii = False) + "\n")
+                file.flush()
+                if record["status"] != "ok":
+                    failed += 1
+                    print(f"{record['id']} failed: {record['error']}", file = sys.stderr)
+                    continue
+                answered += 1
+                completion_tokens += record["completion_tokens"]
+                print(f"[{answered}/{len(pending)}] {record['id']}: {record['total_seconds']:.2f} s, {record['completion_tokens']} tokens")
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.kill()
+            process.join()
+
+    seconds: float = time.perf_counter() - start
+    print(f"Answered {answered} questions in {seconds:.1f} s, {answered / seconds:.2f} questions/s and {completion_tokens / seconds:.1f} tokens/s.")
+    if answered < len(pending):
+        print(f"{len(pending) - answered} questions were not answered, {failed} of them failed. Run again to retry them.", file = sys.stderr)
+    return answered
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog = "python -m llamacpp_server.testing.batch", description = "Answer a JSON lines file of questions offline.")
+    parser.add_argument("questions", help = "JSON lines file of questions.")
+    parser.add_argument("output", help = "JSON lines file to append answers to. Questions already in it are skipped.")
+    parser.add_argument("--model", required = True, help = "Path to the gguf model.")
+    parser.add_argument("--workers", type = int, default = 1, help = "Processes answering at once, each with its own copy of the model.")
+    parser.add_argument("--chunk-size", type = int, default = 8, help = "Questions handed to a worker at a time.")
+    parser.add_argument("--runtime-config", default = "runtime.toml", help = "Llama runtime parameters written by the autotuner.")
+    parser.add_argument("--n-gpu-layers", type = int, default = 0)
+    parser.add_argument("--n-ctx", type = int, default = 1024)
+    parser.add_argument("--max-tokens", type = int, default = 512)
+    parser.add_argument("--temperature", type = float, default = 0.35)
+    parser.add_argument("--top-p", type = float, default = 0.15)
+    parser.add_argument("--documents", help = "Directory of course material to retrieve passages from.")
+    parser.add_argument("--embedding-model", help = "Embedding model for dense retrieval. Keyword retrieval is used without one.")
+    parser.add_argument("--embedding-index", default = "embeddings")
+    parser.add_argument("--context-tokens", type = int, default = 256)
+    arguments = parser.parse_args()
+
+    from llamacpp_server.runtime_config import load_runtime_config
+
+    runtime_config: dict[str, Any] = load_runtime_config(arguments.runtime_config)
+    if arguments.workers > 1:
+        # Thread counts are tuned for one model having the machine to itself, so the workers split the CPU instead.
+        runtime_config.pop("n_threads", None)
+        runtime_config.pop("n_threads_batch", None)
+
+    run_batch(
+        arguments.questions,
+        arguments.output,
+        arguments.model,
+        workers = arguments.workers,
+        chunk_size = arguments.chunk_size,
+        model_kwargs = {"n_gpu_layers": arguments.n_gpu_layers, "n_ctx": arguments.n_ctx} | runtime_config,
+        generation_kwargs = {"max_tokens": arguments.max_tokens, "temperature": arguments.temperature, "top_p": arguments.top_p, "stop": "###"},
+        document_directory = arguments.documents,
+        embedding_model_path = arguments.embedding_model,
+        embedding_index_path = arguments.embedding_index,
+        context_tokens = arguments.context_tokens
+    )
+
+if __name__ == "__main__":
+    main()
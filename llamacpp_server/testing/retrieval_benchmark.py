@@ -0,0 +1,104 @@
+"""
+Compares query latency of dense retrieval over a memory mapped embedding matrix with BM25 keyword retrieval.
+
+Passages are synthetic and, unless embedding_model_path is set, so are the embeddings, which measures the search
+itself rather than the embedding model. BM25 and hybrid retrieval are skipped if Haystack isn't installed.
+Run it from the StudassBot directory:
+    python -m llamacpp_server.testing.retrieval_benchmark
+"""
+
+import os, random, tempfile, zlib
+from time import perf_counter
+from typing import Callable
+
+import numpy as np
+import numpy.typing as npt
+
+from llamacpp_server.lib import BM25Retriever, Embedder, EmbeddingIndex, EmbeddingRetriever
+
+# Set to an embedding model to time real queries end to end, including embedding the question.
+embedding_model_path: str | None = None
+
+passage_count: int = 20_000
+dimensions: int = 768
+query_count: int = 200
+batch_size: int = 16
+top_k: int = 3
+
+vocabulary: tuple[str, ...] = (
+    "class", "object", "method", "interface", "inheritance", "array", "list", "loop", "exception", "constructor",
+    "static", "variable", "string", "integer", "recursion", "compile", "runtime", "null", "pointer", "generic",
+    "stream", "lambda", "thread", "package", "import", "return", "parameter", "override", "abstract", "hash"
+)
+
+class RandomEmbedder:
+    """
+    Stands in for an embedding model. The same text always gets the same unit vector.
+    """
+
+    __slots__ = "dimensions",
+
+    def __init__(self, dimensions: int) -> None:
+        self.dimensions: int = dimensions
+
+    def embed(self, texts: list[str]) -> npt.NDArray[np.float32]:
+        vectors: npt.NDArray[np.float32] = np.stack([
+            np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self.dimensions, dtype = np.float32)
+            for text in texts
+        ])
+        return vectors / np.linalg.norm(vectors, axis = 1, keepdims = True)
+
+def synthetic_text(rng: random.Random, word_count: int) -> str:
+    return " ".join(rng.choice(vocabulary) + str(rng.randrange(200)) for _ in range(word_count))
+
+def time_queries(label: str, retrieve: Callable[[list[str]], object], queries: list[str], batch: int) -> None:
+    start: float = perf_counter()
+    for i in range(0, len(queries), batch):
+        retrieve(queries[i:i + batch])
+    seconds: float = perf_counter() - start
+    print(f"{label:34} | {seconds / len(queries) * 1000:8.3f} ms per query")
+
+def benchmark() -> None:
+    rng = random.Random(0)
+    passages: list[str] = [synthetic_text(rng, 60) for _ in range(passage_count)]
+    queries: list[str] = [synthetic_text(rng, 8) for _ in range(query_count)]
+
+    embedder: Embedder | RandomEmbedder = RandomEmbedder(dimensions) if embedding_model_path is None else Embedder(embedding_model_path)
+
+    try:
+        import haystack
+        has_haystack: bool = True
+    except ImportError:
+        has_haystack = False
+
+    print(f"Passages: {passage_count}, queries: {query_count}, batch size: {batch_size}, top k: {top_k}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for dtype in (np.float16, np.float32):
+            path: str = os.path.join(directory, np.dtype(dtype).name)
+
+            start: float = perf_counter()
+            index: EmbeddingIndex = EmbeddingIndex.build(embedder, passages, path, dtype = dtype, batch_size = 256)
+            print(f"Built {np.dtype(dtype).name} index in {perf_counter() - start:.2f} s, {os.path.getsize(f'{path}.npy') / 2**20:.1f} MB")
+
+            dense = EmbeddingRetriever(index, embedder, top_k)
+            time_queries(f"Dense {np.dtype(dtype).name}, one at a time", dense.retrieve_many, queries, 1)
+            time_queries(f"Dense {np.dtype(dtype).name}, batched", dense.retrieve_many, queries, batch_size)
+
+        if has_haystack:
+            hybrid = EmbeddingRetriever(EmbeddingIndex.open(os.path.join(directory, "float16")), embedder, top_k, hybrid = True)
+            time_queries("Hybrid float16, batched", hybrid.retrieve_many, queries, batch_size)
+            del hybrid
+
+        # Deleted before the directory is removed, since the memory maps hold the files open until they are garbage
+        # collected, and Windows can't delete open files.
+        del dense, index
+
+    if has_haystack:
+        keyword = BM25Retriever({str(i): passage for i, passage in enumerate(passages)}, top_k)
+        time_queries("BM25", lambda batch: [keyword.retrieve(query) for query in batch], queries, 1)
+    else:
+        print("Haystack isn't installed, skipping BM25 and hybrid retrieval.")
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,253 @@
+"""
+Benchmarks every model and configuration in its own process, so the native memory of one model is guaranteed to be
+returned to the OS before the next one loads, and a crash or hang only loses that one job.
+
+Results are appended to a JSON lines file as each job finishes. Jobs already in the file are skipped, so an
+interrupted sweep picks up where it stopped when run again. Edit the settings below and run it from the StudassBot directory:
+    python -m llamacpp_server.testing.sweep
+"""
+
+import json, os, sys, time, traceback
+import multiprocessing as mp
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection
+from typing import Any, Iterable, Iterator
+
+__all__ = "SweepJob", "SweepSummary", "run_sweep", "load_results", "rank_results", "print_ranking"
+
+model_paths: list[str] = []
+configs: list[dict[str, Any]] = [{"n_gpu_layers": -1, "n_ctx": 1024, "n_batch": 256}]
+prompts: list[str] = ["###Question: How can I create a class in Java that represents a celestial body, and create subclasses that represent things like planets and moons?\n###Answer: "]
+run_count: int = 3
+results_path: str = "sweep_results.jsonl"
+# Jobs that run longer, or whose process grows past this many bytes of resident memory, are killed and recorded as failed.
+time_limit: float | None = 900
+memory_limit: int | None = None
+
+# One model with one configuration, benchmarked over all prompts run_count times.
+@dataclass(slots = True)
+class SweepJob:
+    model_path: str
+    config: dict[str, Any] = field(default_factory = dict)
+    prompts: list[str] = field(default_factory = list)
+    run_count: int = 1
+    generation_kwargs: dict[str, Any] = field(default_factory = lambda: {"max_tokens": 128, "temperature": 0.0})
+
+    @property
+    def key(self) -> str:
+        """
+        Identifies the job in the results file. The prompts aren't part of it, so change results_path when changing them.
+        """
+
+        return f"{os.path.basename(self.model_path)} {json.dumps(self.config, sort_keys = True)}"
+
+# Throughput of one finished job, averaged over all its runs.
+@dataclass(slots = True)
+class SweepSummary:
+    key: str
+    model: str
+    config: dict[str, Any]
+    prefill_tokens_per_second: float
+    decode_tokens_per_second: float
+    # Average prefill plus decode time per prompt, which is what a student waits for.
+    mean_request_seconds: float
+    load_seconds: float
+    peak_rss_bytes: int
+
+def peak_rss_bytes() -> int:
+    """
+    Peak resident memory of this process, or 0 on Windows, which has no resource module.
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return 0
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def current_rss_bytes(pid: int) -> int | None:
+    """
+    Resident memory of another process, or None where /proc isn't available.
+    """
+
+    try:
+        with open(f"/proc/{pid}/status", "r") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+def run_job(job: SweepJob, connection: Connection) -> None:
+    """
+    The body of a job process. Sends back one dict with the measurements, or with the error that stopped them.
+    """
+
+    try:
+        from llamacpp_server.lib import LLM, StaticResult
+
+        start: float = time.perf_counter()
+        llm = LLM(job.model_path, verbose = False, **job.config)
+        load_seconds: float = time.perf_counter() - start
+
+        runs: list[dict[str, Any]] = []
+        for _ in range(job.run_count):
+            for prompt in job.prompts:
+                result: StaticResult = llm(prompt, **job.generation_kwargs)
+                runs.append({
+                    "prompt_tokens": result.prompt_token_count,
+                    "completion_tokens": result.response_token_count,
+                    "prefill_seconds": result.prefill_time,
+                    "decode_seconds": result.decode_time,
+                    "finish_reason": result.finish_reason
+                })
+
+        connection.send({"status": "ok", "load_seconds": load_seconds, "peak_rss_bytes": peak_rss_bytes(), "runs": runs})
+    except BaseException:
+        connection.send({"status": "error", "error": traceback.format_exc()})
+    finally:
+        connection.close()
+
+def supervise(job: SweepJob, time_limit: float | None, memory_limit: int | None) -> dict[str, Any]:
+    """
+    Run a job in a fresh process and wait for it, killing it if it goes over a limit.
+    """
+
+    # Spawned rather than forked, so the job doesn't inherit anything a previous job or the parent loaded.
+    context = mp.get_context("spawn")
+    receiver, sender = context.Pipe(duplex = False)
+    process = context.Process(target = run_job, args = (job, sender), daemon = True)
+
+    start: float = time.perf_counter()
+    process.start()
+    sender.close()
+
+    outcome: dict[str, Any] | None = None
+    try:
+        while outcome is None:
+            if receiver.poll(0.5):
+                try:
+                    outcome = receiver.recv()
+                except EOFError:
+                    process.join()
+                    outcome = {"status": "crashed", "error": f"Exited with code {process.exitcode} without a result."}
+                break
+
+            if time_limit is not None and time.perf_counter() - start > time_limit:
+                outcome = {"status": "time_limit", "error": f"Still running after {time_limit} seconds."}
+            elif memory_limit is not None and (rss := current_rss_bytes(process.pid)) is not None and rss > memory_limit:
+                outcome = {"status": "memory_limit", "error": f"Resident memory reached {rss} bytes."}
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        receiver.close()
+
+    return outcome
+
+def load_results(file_path: str) -> Iterator[dict[str, Any]]:
+    """
+    Stream the records of a results file. A line cut off by a crash while it was written is skipped.
+    """
+
+    if not os.path.exists(file_path):
+        return
+
+    with open(file_path, "r", encoding = "utf-8") as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def run_sweep(jobs: Iterable[SweepJob], file_path: str, time_limit: float | None = None, memory_limit: int | None = None, retry_failed: bool = False) -> None:
+    """
+    Run every job that isn't in the results file yet and append its record as soon as it finishes.
+    Failed jobs are recorded too and skipped next time, unless retry_failed is set.
+    """
+
+    finished: set[str] = {
+        record["key"]
+        for record in load_results(file_path)
+        if record["status"] == "ok" or not retry_failed
+    }
+
+    for job in jobs:
+        if job.key in finished:
+            print(f"Skipping {job.key}")
+            continue
+
+        print(f"Running {job.key}")
+        start: float = time.perf_counter()
+        outcome: dict[str, Any] = supervise(job, time_limit, memory_limit)
+
+        record: dict[str, Any] = {
+            "key": job.key,
+            "model": os.path.basename(job.model_path),
+            "model_path": job.model_path,
+            "config": job.config,
+            "seconds": time.perf_counter() - start,
+            "finished_at": time.time()
+        } | outcome
+
+        with open(file_path, "a", encoding = "utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        finished.add(job.key)
+        print(f"{outcome['status']}: {job.key}")
+        if outcome["status"] != "ok":
+            print(outcome["error"], file = sys.stderr, flush = True)
+
+def rank_results(file_path: str) -> list[SweepSummary]:
+    """
+    Summarize every successful job, fastest decoding first. The last record of a job counts if it was run more than once.
+    """
+
+    latest: dict[str, dict[str, Any]] = {}
+    for record in load_results(file_path):
+        if record["status"] == "ok":
+            latest[record["key"]] = record
+
+    summaries: list[SweepSummary] = []
+    for key, record in latest.items():
+        runs: list[dict[str, Any]] = record["runs"]
+        prefill_seconds: float = sum(run["prefill_seconds"] for run in runs)
+        decode_seconds: float = sum(run["decode_seconds"] for run in runs)
+        summaries.append(SweepSummary(
+            key = key,
+            model = record["model"],
+            config = record["config"],
+            prefill_tokens_per_second = sum(run["prompt_tokens"] for run in runs) / prefill_seconds if prefill_seconds > 0 else 0.0,
+            # The first completion token is sampled at the end of prefill, so decoding produced the rest.
+            decode_tokens_per_second = sum(max(run["completion_tokens"] - 1, 0) for run in runs) / decode_seconds if decode_seconds > 0 else 0.0,
+            mean_request_seconds = (prefill_seconds + decode_seconds) / len(runs),
+            load_seconds = record["load_seconds"],
+            peak_rss_bytes = record["peak_rss_bytes"]
+        ))
+
+    return sorted(summaries, key = lambda summary: summary.decode_tokens_per_second, reverse = True)
+
+def print_ranking(summaries: list[SweepSummary]) -> None:
+    for summary in summaries:
+        print(
+            f"{summary.key:70} | Decode tps: {summary.decode_tokens_per_second:8.3f} | Prefill tps: {summary.prefill_tokens_per_second:9.3f}"
+            f" | Per prompt: {summary.mean_request_seconds:7.2f} s | Load: {summary.load_seconds:6.1f} s | Peak RSS: {summary.peak_rss_bytes / 2**30:5.2f} GiB"
+        )
+
+def main() -> None:
+    jobs: list[SweepJob] = [
+        SweepJob(model_path, config, prompts, run_count)
+        for model_path in model_paths
+        for config in configs
+    ]
+    run_sweep(jobs, results_path, time_limit, memory_limit)
+    print_ranking(rank_results(results_path))
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,14 @@
 import re, os
 from io import StringIO
-from typing import Iterator
+from typing import Iterable, Iterator, TextIO
 
-from docx import Document as DocxDocument
-from pdfminer.high_level import extract_pages as extract_pdf_pages
-from pdfminer.layout import LTTextContainer as PdfLTTextContainer, LTPage as PdfLTPage, LAParams as PdfLAParams
-
-__all__ = "parse_pdf", "parse_pdf_to_file", "parse_docx", "parse_docx_to_file", "parse_directory", "parse_directory_to_files", "parse_txt", "parse_test_data", "humanreadable_test_data"
+__all__ = "parse_pdf", "parse_pdf_to_file", "parse_docx", "parse_docx_to_file", "parse_directory", "parse_directory_to_files", "parse_txt", "iter_test_data", "parse_test_data", "write_humanreadable", "humanreadable_test_data"
 
 
 def parse_pdf(path: str) -> str:
+    # pdfminer and python-docx are slow to import, so they are only imported once a file of their type is parsed.
+    from pdfminer.high_level import extract_pages as extract_pdf_pages
+    from pdfminer.layout import LTTextContainer as PdfLTTextContainer, LTPage as PdfLTPage, LAParams as PdfLAParams
 
     pages: Iterator[PdfLTPage] = extract_pdf_pages(
         pdf_file = path,
@@ -29,6 +28,8 @@ def parse_pdf(path: str) -> str:
     return re.sub(r"\n\s+", "\n\n", output.getvalue())
 
 def parse_docx(path: str) -> str:
+    from docx import Document as DocxDocument
+
     document = DocxDocument(path)
 
     output = StringIO()
@@ -72,36 +73,53 @@ def parse_directory_to_files(input_directory: str, output_directory: str, encodi
         with open(os.path.join(output_directory, f"{file_path.split("\\")[-1]}.txt"), "w+", encoding = encoding) as file:
             file.write(text)
 
-def parse_test_data(file_path: str) -> dict[int, list[tuple[str, str]]]:
-    result: dict[int, list[tuple[str, str]]] = {}
+def iter_test_data(file_path: str, chunk_size: int = 1 << 20) -> Iterator[tuple[int, str, str]]:
+    """
+    Stream the user id, question and response of every record in a messages.csv file, reading it in chunks.
+    Empty records, like the one after the final separator, are skipped.
+    """
+
     with open(file_path, "r", encoding = "utf-8") as file:
-        text: str = file.read()
-        instances: list[str] = text.split("§§§")
+        rest: str = ""
+        while len(chunk := file.read(chunk_size)) > 0:
+            *instances, rest = (rest + chunk).split("§§§")
+            for instance in instances:
+                if instance.strip() != "":
+                    user_id, question, response = instance.split("¤¤¤", 2)
+                    yield int(user_id), question, response
+
+    if rest.strip() != "":
+        user_id, question, response = rest.split("¤¤¤", 2)
+        yield int(user_id), question, response
 
-    for instance in instances:
-        if instance == "":
-            break
-        user_id, question, response = instance.split("¤¤¤")
+def parse_test_data(file_path: str) -> dict[int, list[tuple[str, str]]]:
+    result: dict[int, list[tuple[str, str]]] = {}
 
-        if int(user_id) not in result.keys():
-            result[int(user_id)] = []
+    for user_id, question, response in iter_test_data(file_path):
+        if user_id not in result.keys():
+            result[user_id] = []
 
-        result[int(user_id)].append((question, response))
+        result[user_id].append((question, response))
 
     return result
 
-def humanreadable_test_data(test_data: dict[int, list[tuple[str, str]]]) -> str:
-    result = StringIO()
+def write_humanreadable(conversations: Iterable[tuple[int, Iterable[tuple[str, str]]]], file: TextIO) -> None:
+    """
+    Write each user's questions and responses as indented text, one conversation at a time.
+    """
 
-    for user_id, messages in test_data.items():
-        result.write(str(user_id))
+    for user_id, messages in conversations:
+        file.write(str(user_id))
         for question, response in messages:
-            result.write("\n\tQuestion:")
+            file.write("\n\tQuestion:")
             for line in question.strip().splitlines():
-                result.write(f"\n\t\t{line}")
-            result.write("\n\tResponse:")
+                file.write(f"\n\t\t{line}")
+            file.write("\n\tResponse:")
             for line in response.strip().splitlines():
-                result.write(f"\n\t\t{line}")
-        result.write("\n")
+                file.write(f"\n\t\t{line}")
+        file.write("\n")
 
-    return result.getvalue()
\ No newline at end of file
+def humanreadable_test_data(test_data: dict[int, list[tuple[str, str]]]) -> str:
+    result = StringIO()
+    write_humanreadable(test_data.items(), result)
+    return result.getvalue()